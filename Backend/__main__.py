@@ -6,8 +6,12 @@ from pyrogram import idle
 from Backend import __version__, db
 from Backend.logger import LOGGER
 from Backend.fastapi import server
+from Backend.config import Telegram
+from Backend.helper.chunk_cache import chunk_cache
+from Backend.helper.custom_dl import stream_cursors
+from Backend.helper.session_pool import session_pool
 from Backend.helper.pyro import restart_notification, setup_bot_commands
-from Backend.pyrofork.bot import Helper, StreamBot
+from Backend.pyrofork.bot import Helper, StreamBot, multi_clients
 from Backend.pyrofork.clients import initialize_clients
 
 loop = get_event_loop()
@@ -34,6 +38,10 @@ async def start_services():
         await initialize_clients()
         await asleep(2)
 
+        await session_pool.prewarm(multi_clients, Telegram.PREWARM_DCS or await db.get_indexed_dcs())
+        loop.create_task(session_pool.health_check(multi_clients))
+        loop.create_task(db.maintain_counters(Telegram.COUNTER_RECONCILE_INTERVAL))
+
         await setup_bot_commands(StreamBot)
         await asleep(2)
 
@@ -56,10 +64,13 @@ async def stop_services():
         
         await asyncio.gather(*pending_tasks, return_exceptions=True)
 
+        stream_cursors.close()
+        await session_pool.close()
         await StreamBot.stop()
         await Helper.stop()
 
         await db.disconnect()
+        chunk_cache.close()
         
         LOGGER.info("Services stopped successfully.")
     except Exception:
@@ -25,4 +25,32 @@ class Telegram:
 
     ADMIN_USERNAME = getenv("ADMIN_USERNAME", "fyvio")
     ADMIN_PASSWORD = getenv("ADMIN_PASSWORD", "fyvio")
-    
+
+    PREFETCH_PARTS = int(getenv("PREFETCH_PARTS", "4"))
+    PREFETCH_MAX_MB = int(getenv("PREFETCH_MAX_MB", "64"))
+    MIN_PART_KB = int(getenv("MIN_PART_KB", "64"))
+    STRIPE_CLIENTS = int(getenv("STRIPE_CLIENTS", "4"))
+    CURSOR_GRACE = int(getenv("CURSOR_GRACE", "15"))
+    CONTAINER_PREFETCH = getenv("CONTAINER_PREFETCH", "true").lower() == "true"
+    WARMUP_BUDGET_MB = int(getenv("WARMUP_BUDGET_MB", "64"))
+    DAILY_TRANSFER_GB = int(getenv("DAILY_TRANSFER_GB", "0"))
+    MEDIA_SESSIONS_PER_DC = int(getenv("MEDIA_SESSIONS_PER_DC", "2"))
+    CDN_SUPPORT = getenv("CDN_SUPPORT", "false").lower() == "true"
+    PREWARM_DCS = [int(dc) for dc in (getenv("PREWARM_DCS") or "").split(",") if dc.strip()]
+    CHUNK_CACHE_DIR = getenv("CHUNK_CACHE_DIR", "cache")
+    CHUNK_CACHE_MB = int(getenv("CHUNK_CACHE_MB", "0"))
+    PINNED_CACHE_MB = int(getenv("PINNED_CACHE_MB", "0"))
+    PINNED_HEAD_PARTS = int(getenv("PINNED_HEAD_PARTS", "2"))
+    PINNED_TAIL_PARTS = int(getenv("PINNED_TAIL_PARTS", "1"))
+    PIN_ON_INGEST = getenv("PIN_ON_INGEST", "false").lower() == "true"
+    FILE_CACHE_SIZE = int(getenv("FILE_CACHE_SIZE", "10000"))
+    FILE_CACHE_TTL = int(getenv("FILE_CACHE_TTL", "1800"))
+    QOS_IP_RATE_MB = float(getenv("QOS_IP_RATE_MB", "0"))
+    QOS_TOKEN_RATE_MB = float(getenv("QOS_TOKEN_RATE_MB", "0"))
+    QOS_GLOBAL_RATE_MB = float(getenv("QOS_GLOBAL_RATE_MB", "0"))
+    QOS_BULK_SHARE = float(getenv("QOS_BULK_SHARE", "0.3"))
+    QOS_IP_STREAMS = int(getenv("QOS_IP_STREAMS", "0"))
+    QOS_MAX_DELAY = float(getenv("QOS_MAX_DELAY", "10"))
+    METRICS_TOKEN = getenv("METRICS_TOKEN", "")
+    COUNTER_RECONCILE_INTERVAL = int(getenv("COUNTER_RECONCILE_INTERVAL", "21600"))
+    SHARD_TIMEOUT = float(getenv("SHARD_TIMEOUT", "10"))
@@ -1,5 +1,7 @@
+import secrets
+from typing import Optional
 from fastapi import FastAPI, Request, Form, Depends, Query, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
@@ -85,9 +87,10 @@ async def list_media(
     page: int = Query(1, ge=1),
     page_size: int = Query(24, ge=1, le=100),
     search: str = Query("", max_length=100),
+    cursor: Optional[str] = Query(None, max_length=512),
     _: bool = Depends(require_auth)
 ):
-    return await list_media_api(media_type, page, page_size, search)
+    return await list_media_api(media_type, page, page_size, search, cursor)
 
 @app.delete("/api/media/delete")
 async def delete_media(tmdb_id: int, db_index: int, media_type: str, _: bool = Depends(require_auth)):
@@ -116,18 +119,41 @@ async def delete_tv_season(tmdb_id: int, db_index: int, season: int, _: bool = D
 @app.get("/api/system/workloads")
 async def get_workloads(_: bool = Depends(require_auth)):
     try:
-        from Backend.pyrofork.bot import work_loads
+        from Backend.pyrofork.scheduler import scheduler
+        from Backend.helper.single_flight import part_flights
+        from Backend.helper.file_cache import file_cache
+        from Backend.helper.custom_dl import recovery_stats, stream_cursors
+        from Backend.helper.qos import stream_qos
+        from Backend.helper.episode_warmer import episode_warmer
+        from Backend.helper.shard_executor import shard_executor
         return {
-            "loads": {
-                f"bot{c + 1}": l
-                for c, (_, l) in enumerate(
-                    sorted(work_loads.items(), key=lambda x: x[1], reverse=True)
-                )
-            } if work_loads else {}
+            "loads": scheduler.loads(),
+            "clients": scheduler.snapshot(),
+            "part_fetches": dict(part_flights.stats),
+            "file_cache": {**file_cache.stats, "size": len(file_cache.entries)},
+            "recovery": dict(recovery_stats),
+            "cursors": {**stream_cursors.stats, "parked_now": len(stream_cursors.cursors)},
+            "qos": stream_qos.snapshot(),
+            "episode_warmups": dict(episode_warmer.stats),
+            "shards": shard_executor.snapshot()
         }
     except Exception as e:
         return {"loads": {}}
 
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    # Scrapers cannot log in to the panel, so this takes a bearer token
+    # instead. Without METRICS_TOKEN the endpoint is disabled.
+    from Backend.config import Telegram
+    from Backend.helper.metrics import registry
+    if not Telegram.METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    if not secrets.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {Telegram.METRICS_TOKEN}"
+    ):
+        raise HTTPException(status_code=403, detail="Invalid metrics token")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.exception_handler(401)
 async def auth_exception_handler(request: Request, exc):
     return RedirectResponse(url="/login", status_code=302)
@@ -0,0 +1,106 @@
+import asyncio
+from time import monotonic
+from typing import AsyncIterator, List, Mapping, Optional, Union
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+from Backend.helper.metrics import aborted_streams, active_streams, bytes_served, ttfb_seconds
+from Backend.helper.qos import StreamGrant
+
+
+# Pieces smaller than this are gathered into one send; bigger ones go out
+# as they are.
+SEND_SIZE = 256 * 1024
+
+Piece = Union[bytes, memoryview]
+
+
+class MediaResponse(Response):
+    # Streams media pieces straight to the ASGI server. Pieces may be
+    # memoryviews into fetched parts, so nothing is copied on the way out
+    # except when small pieces are coalesced. Each send is awaited, which is
+    # where the server applies backpressure, and a client disconnect cancels
+    # the body iterator at once, closing the upstream fetches behind it.
+    # With a QoS grant every send is paced by the viewer's token buckets.
+    # `started` is when the request came in, for the time-to-first-byte
+    # histogram.
+    def __init__(
+        self,
+        content: AsyncIterator[Piece],
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        send_size: int = SEND_SIZE,
+        grant: Optional[StreamGrant] = None,
+        started: Optional[float] = None,
+    ):
+        self.body_iterator = content
+        self.status_code = status_code
+        self.media_type = media_type
+        self.send_size = send_size
+        self.grant = grant
+        self.started = started
+        self.background = None
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        stream = asyncio.create_task(self.stream(send))
+        watcher = asyncio.create_task(self.wait_disconnect(receive))
+        active_streams.inc()
+        try:
+            await asyncio.wait((stream, watcher), return_when=asyncio.FIRST_COMPLETED)
+            if not stream.done():
+                aborted_streams.inc("disconnect")
+            elif stream.cancelled() or stream.exception():
+                aborted_streams.inc("error")
+        finally:
+            active_streams.inc(amount=-1)
+            for task in (stream, watcher):
+                task.cancel()
+            if self.grant:
+                self.grant.release()
+            await asyncio.gather(watcher, return_exceptions=True)
+            try:
+                await stream
+            except asyncio.CancelledError:
+                # Only a disconnect is swallowed; any other cancellation
+                # came from outside and has to propagate.
+                if watcher.cancelled():
+                    raise
+
+    async def wait_disconnect(self, receive: Receive) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    async def stream(self, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        pending: List[Piece] = []
+        pending_size = 0
+        try:
+            async for piece in self.body_iterator:
+                if not piece:
+                    continue
+                if pending and pending_size + len(piece) > self.send_size:
+                    await self.send_body(send, pending)
+                    pending, pending_size = [], 0
+                pending.append(piece)
+                pending_size += len(piece)
+                if pending_size >= self.send_size:
+                    await self.send_body(send, pending)
+                    pending, pending_size = [], 0
+            if pending:
+                await self.send_body(send, pending)
+        finally:
+            await self.body_iterator.aclose()
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def send_body(self, send: Send, pieces: List[Piece]) -> None:
+        body = pieces[0] if len(pieces) == 1 else b"".join(pieces)
+        if self.grant:
+            await self.grant.pace(len(body))
+        if self.started is not None:
+            ttfb_seconds.observe(monotonic() - self.started)
+            self.started = None
+        await send({"type": "http.response.body", "body": body, "more_body": True})
+        bytes_served.inc(amount=len(body))
@@ -1,3 +1,4 @@
+from typing import Optional
 from fastapi import Request, Query, HTTPException
 from Backend import db
 
@@ -7,7 +8,8 @@ async def list_media_api(
     media_type: str = Query("movie", regex="^(movie|tv)$"),
     page: int = Query(1, ge=1),
     page_size: int = Query(24, ge=1, le=100),
-    search: str = Query("", max_length=100)
+    search: str = Query("", max_length=100),
+    cursor: Optional[str] = Query(None, max_length=512)
 ):
     try:
         if search:
@@ -26,9 +28,11 @@ async def list_media_api(
             }
         else:
             if media_type == "movie":
-                return await db.sort_movies([], page, page_size)
+                return await db.sort_movies([], page, page_size, cursor=cursor)
             else:
-                return await db.sort_tv_shows([], page, page_size)
+                return await db.sort_tv_shows([], page, page_size, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -51,10 +51,7 @@ async def public_view(request: Request, media_type: str, tmdb_id: int, db_index:
         media_data = await db.get_media_details(tmdb_id, db_index)
     else:
         # Fallback: Find which DB it lives in
-        for idx in range(1, db.current_db_index + 1):
-             media_data = await db.get_media_details(tmdb_id, idx)
-             if media_data:
-                 break
+        media_data = await db.find_media_details(tmdb_id)
     
     if not media_data:
          raise HTTPException(status_code=404, detail="Media not found in archive")
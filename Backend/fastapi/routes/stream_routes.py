@@ -1,117 +1,214 @@
-import math
 import secrets
 import mimetypes
-from typing import Tuple
+from time import monotonic
+from typing import Callable, List, Optional, Tuple
 from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response
 
-from Backend.helper.encrypt import decode_string
+from Backend.fastapi.media_response import MediaResponse
+from Backend.helper.encrypt import decode_token
+from Backend.helper.episode_warmer import WARM_AT, episode_warmer
 from Backend.helper.exceptions import InvalidHash
-from Backend.helper.custom_dl import ByteStreamer
-from Backend.pyrofork.bot import StreamBot, work_loads, multi_clients
+from Backend.helper.qos import stream_qos
+from Backend.helper.custom_dl import get_streamer, pick_stripe
+from Backend.pyrofork.scheduler import scheduler
 
 router = APIRouter(tags=["Streaming"])
-class_cache = {}
 
 
-def parse_range_header(range_header: str, file_size: int) -> Tuple[int, int]:
+MAX_RANGES = 16
+
+
+def parse_range_header(range_header: str, file_size: int) -> List[Tuple[int, int]]:
     if not range_header:
-        return 0, file_size - 1
+        return [(0, file_size - 1)]
     try:
-        range_value = range_header.replace("bytes=", "")
-        from_str, until_str = range_value.split("-")
-        from_bytes = int(from_str)
-        until_bytes = int(until_str) if until_str else file_size - 1
+        unit, _, range_set = range_header.partition("=")
+        if unit.strip().lower() != "bytes":
+            raise ValueError("unsupported range unit")
+        specs = [spec.strip() for spec in range_set.split(",") if spec.strip()]
+        if not specs or len(specs) > MAX_RANGES:
+            raise ValueError("bad number of ranges")
+        ranges = []
+        for spec in specs:
+            from_str, until_str = spec.split("-")
+            if not from_str:
+                suffix = int(until_str)
+                if suffix <= 0 or file_size == 0:
+                    continue
+                ranges.append((max(0, file_size - suffix), file_size - 1))
+                continue
+            from_bytes = int(from_str)
+            until_bytes = min(int(until_str), file_size - 1) if until_str else file_size - 1
+            if from_bytes < 0 or (until_str and int(until_str) < from_bytes):
+                raise ValueError(f"invalid range {spec}")
+            if from_bytes <= until_bytes:
+                ranges.append((from_bytes, until_bytes))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid Range header: {e}")
 
-    if (until_bytes > file_size - 1) or (from_bytes < 0) or (until_bytes < from_bytes):
+    if not ranges:
         raise HTTPException(
             status_code=416,
             detail="Requested Range Not Satisfiable",
             headers={"Content-Range": f"bytes */{file_size}"},
         )
 
-    return from_bytes, until_bytes
+    # Overlapping or touching ranges are coalesced (RFC 7233 section 4.1),
+    # which also puts them in file order for the part planner.
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def multipart_headers(ranges: List[Tuple[int, int]], boundary: str, mime_type: str, file_size: int) -> List[bytes]:
+    return [
+        (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {mime_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+        ).encode()
+        for start, end in ranges
+    ]
+
+
+async def multipart_body(pieces, part_headers: List[bytes], boundary: str):
+    current = -1
+    async for number, data in pieces:
+        while current < number:
+            current += 1
+            yield part_headers[current]
+        yield data
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+
+async def range_body(pieces, position: int = 0, checkpoint: Optional[Tuple[int, Callable[[], None]]] = None):
+    # `checkpoint` is called once the body, read sequentially from below the
+    # given file offset, gets past it. Ranges starting past it, like the
+    # tail probes players send before playback, never fire it.
+    if checkpoint and position >= checkpoint[0]:
+        checkpoint = None
+    async for _, data in pieces:
+        yield data
+        position += len(data)
+        if checkpoint and position >= checkpoint[0]:
+            checkpoint[1]()
+            checkpoint = None
 
 
 @router.get("/dl/{id}/{name}")
 @router.head("/dl/{id}/{name}")
 async def stream_handler(request: Request, id: str, name: str):
-    decoded_data = await decode_string(id)
-    if not decoded_data.get("msg_id"):
+    try:
+        chat_id, msg_id = decode_token(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid id")
+    if not msg_id:
         raise HTTPException(status_code=400, detail="Missing id")
 
-    chat_id = f"-100{decoded_data['chat_id']}"
-    message = await StreamBot.get_messages(int(chat_id), int(decoded_data["msg_id"]))
-    file = message.video or message.document
-    file_hash = file.file_unique_id[:6]
-
     return await media_streamer(
         request,
-        chat_id=int(chat_id),
-        id=int(decoded_data["msg_id"]),
-        secure_hash=file_hash
+        chat_id=int(f"-100{chat_id}"),
+        id=msg_id,
+        token=id
     )
 
 
+def etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
 async def media_streamer(
     request: Request,
     chat_id: int,
     id: int,
-    secure_hash: str,
-) -> StreamingResponse:
+    secure_hash: Optional[str] = None,
+    token: Optional[str] = None,
+) -> Response:
+    started = monotonic()
     range_header = request.headers.get("Range", "")
-    index = min(work_loads, key=work_loads.get)
-    faster_client = multi_clients[index]
-
-    tg_connect = class_cache.get(faster_client)
-    if not tg_connect:
-        tg_connect = ByteStreamer(faster_client)
-        class_cache[faster_client] = tg_connect
-
-    file_id = await tg_connect.get_file_properties(chat_id=chat_id, message_id=id)
-    if file_id.unique_id[:6] != secure_hash:
+    file_id = await get_streamer(scheduler.pick()).get_file_properties(chat_id=chat_id, message_id=id)
+    if secure_hash and file_id.unique_id[:6] != secure_hash:
         raise InvalidHash
 
     file_size = file_id.file_size
-    from_bytes, until_bytes = parse_range_header(range_header, file_size)
-
-    chunk_size = 1024 * 1024
-    offset = from_bytes - (from_bytes % chunk_size)
-    first_part_cut = from_bytes - offset
-    last_part_cut = (until_bytes % chunk_size) + 1
-    req_length = until_bytes - from_bytes + 1
-    part_count = math.ceil(until_bytes / chunk_size) - math.floor(offset / chunk_size)
-
-    body = tg_connect.yield_file(
-        file_id, index, offset, first_part_cut, last_part_cut, part_count, chunk_size
-    )
-
     file_name = file_id.file_name or f"{secrets.token_hex(2)}.unknown"
     mime_type = file_id.mime_type or mimetypes.guess_type(file_name)[0] or "application/octet-stream"
     if not file_id.file_name and "/" in mime_type:
         file_name = f"{secrets.token_hex(2)}.{mime_type.split('/')[1]}"
 
+    etag = f'"{file_id.unique_id}"'
     headers = {
         "Content-Type": mime_type,
-        "Content-Length": str(req_length),
         "Content-Disposition": f'inline; filename="{file_name}"',
         "Accept-Ranges": "bytes",
+        "ETag": etag,
         "Cache-Control": "public, max-age=3600, immutable",
         "Access-Control-Allow-Origin": "*",
-        "Access-Control-Expose-Headers": "Content-Length, Content-Range, Accept-Ranges",
+        "Access-Control-Expose-Headers": "Content-Length, Content-Range, Accept-Ranges, ETag",
     }
-    
-    if range_header:
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        del headers["Content-Type"]
+        return Response(status_code=304, headers=headers)
+
+    if_range = request.headers.get("If-Range")
+    if range_header and if_range and if_range.strip() != etag:
+        range_header = ""
+
+    ranges = parse_range_header(range_header, file_size)
+    boundary = None
+    if len(ranges) > 1:
+        boundary = secrets.token_hex(16)
+        part_headers = multipart_headers(ranges, boundary, mime_type, file_size)
+        headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+        req_length = sum(len(h) for h in part_headers) + sum(end - start + 1 for start, end in ranges)
+        req_length += len(f"\r\n--{boundary}--\r\n")
+    else:
+        from_bytes, until_bytes = ranges[0]
+        req_length = until_bytes - from_bytes + 1
+    headers["Content-Length"] = str(req_length)
+
+    if boundary:
+        status_code = 206
+    elif range_header:
         headers["Content-Range"] = f"bytes {from_bytes}-{until_bytes}/{file_size}"
         status_code = 206
     else:
         status_code = 200
-    
-    return StreamingResponse(
+
+    # Headers come from cached or indexed metadata only; HEAD never opens a
+    # media session or touches Telegram.
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers)
+
+    client_ip = request.client.host if request.client else ""
+    grant = stream_qos.admit(client_ip, (chat_id, id), file_id.media_id)
+
+    index = scheduler.pick(file_id.dc_id)
+    tg_connect = get_streamer(index)
+
+    client_key = (client_ip, request.headers.get("User-Agent", ""))
+    pieces = tg_connect.yield_ranges(
+        file_id, index, ranges, pick_stripe(index, file_id.dc_id), chat_id, id, client_key
+    )
+    if boundary:
+        body = multipart_body(pieces, part_headers, boundary)
+    else:
+        checkpoint = (int(file_size * WARM_AT), lambda: episode_warmer.warm_after(token, file_name)) if token else None
+        body = range_body(pieces, from_bytes, checkpoint)
+
+    return MediaResponse(
         status_code=status_code,
         content=body,
         headers=headers,
-        media_type=mime_type,
-    )
\ No newline at end of file
+        grant=grant,
+        started=started,
+    )
@@ -4,7 +4,8 @@ from fastapi.templating import Jinja2Templates
 from Backend.fastapi.security.credentials import verify_credentials, require_auth, is_authenticated, get_current_user
 from Backend.fastapi.themes import get_theme, get_all_themes
 from Backend import db
-from Backend.pyrofork.bot import work_loads, multi_clients, StreamBot
+from Backend.pyrofork.bot import multi_clients, StreamBot
+from Backend.pyrofork.scheduler import scheduler
 from Backend.helper.pyro import get_readable_time
 from Backend import StartTime, __version__
 from time import time
@@ -56,12 +57,7 @@ async def dashboard_page(request: Request, _: bool = Depends(require_auth)):
             "uptime": get_readable_time(time() - StartTime),
             "telegram_bot": f"@{StreamBot.username}" if StreamBot and StreamBot.username else "Unknown",
             "connected_bots": len(multi_clients),
-            "loads": {
-                f"bot{c + 1}": l
-                for c, (_, l) in enumerate(
-                    sorted(work_loads.items(), key=lambda x: x[1], reverse=True)
-                )
-            } if work_loads else {},
+            "loads": scheduler.loads(),
             "version": __version__,
             "movies": total_movies,
             "tv_shows": total_tv_shows,
@@ -0,0 +1,179 @@
+import asyncio
+from base64 import b64decode
+from hashlib import sha1, sha256
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+from pyrogram import Client, raw
+from pyrogram.connection import Connection
+from pyrogram.connection.transport import TCPAbridged
+from pyrogram.crypto import aes, rsa
+from pyrogram.errors import CDNFileHashMismatch
+from pyrogram.raw.core import Bytes
+from pyrogram.session import Session
+from Backend.logger import LOGGER
+
+
+# Parts below this size are widened to a whole hash block so every byte
+# handed out has been verified.
+HASH_BLOCK = 128 * 1024
+MAX_REUPLOADS = 3
+# How often the server config is fetched again when a CDN DC is missing
+# from it.
+CONFIG_RELOAD_INTERVAL = 10 * 60
+
+
+def parse_rsa_key(pem: str) -> rsa.PublicKey:
+    # PKCS#1 "RSA PUBLIC KEY": a DER sequence of the modulus and exponent.
+    der = b64decode("".join(line for line in pem.strip().splitlines() if not line.startswith("-----")))
+
+    def header(pos: int) -> Tuple[int, int]:
+        length = der[pos + 1]
+        pos += 2
+        if length & 0x80:
+            size = length & 0x7F
+            length = int.from_bytes(der[pos:pos + size], "big")
+            pos += size
+        return pos, length
+
+    pos, _ = header(0)
+    values = []
+    for _ in range(2):
+        pos, length = header(pos)
+        values.append(int.from_bytes(der[pos:pos + length], "big"))
+        pos += length
+    return rsa.PublicKey(*values)
+
+
+def rsa_fingerprint(key: rsa.PublicKey) -> int:
+    # Lower 64 bits of SHA1 over the TL-serialized modulus and exponent,
+    # signed like the keys in pyrogram's table.
+    serialized = b"".join(
+        Bytes(value.to_bytes((value.bit_length() + 7) // 8, "big")) for value in (key.m, key.e)
+    )
+    return int.from_bytes(sha1(serialized).digest()[-8:], "little", signed=True)
+
+
+class CdnDirectory:
+    # CDN DCs are not in pyrogram's static DC and RSA key tables. Their
+    # addresses come from help.getConfig and their keys from
+    # help.getCdnConfig; the keys are added to pyrogram's RSA table and
+    # clients get a connection factory that knows the addresses.
+    def __init__(self):
+        self.addresses: Dict[Tuple[int, bool], Tuple[str, int]] = {}
+        self.loaded_at = -CONFIG_RELOAD_INTERVAL
+        self.lock = asyncio.Lock()
+
+    def address(self, dc_id: int, ipv6: bool) -> Optional[Tuple[str, int]]:
+        return self.addresses.get((dc_id, ipv6))
+
+    async def prepare(self, client: Client, dc_id: int) -> None:
+        if self.address(dc_id, client.ipv6) is None:
+            async with self.lock:
+                if self.address(dc_id, client.ipv6) is None and monotonic() - self.loaded_at >= CONFIG_RELOAD_INTERVAL:
+                    await self.load(client)
+        if self.address(dc_id, client.ipv6) is None:
+            raise ConnectionError(f"CDN DC {dc_id} is not in the server config")
+        if client.connection_factory is Connection:
+            client.connection_factory = CdnConnection
+
+    async def load(self, client: Client) -> None:
+        self.loaded_at = monotonic()
+        config = await client.invoke(raw.functions.help.GetConfig())
+        for option in config.dc_options:
+            if option.cdn:
+                self.addresses[(option.id, bool(option.ipv6))] = (option.ip_address, option.port)
+        cdn_config = await client.invoke(raw.functions.help.GetCdnConfig())
+        for public_key in cdn_config.public_keys:
+            try:
+                key = parse_rsa_key(public_key.public_key)
+            except (ValueError, IndexError) as e:
+                LOGGER.warning(f"Could not parse the RSA key of CDN DC {public_key.dc_id}: {e}")
+                continue
+            rsa.server_public_keys.setdefault(rsa_fingerprint(key), key)
+        LOGGER.debug(f"Loaded CDN DCs {sorted({dc_id for dc_id, _ in self.addresses})}")
+
+
+cdn_directory = CdnDirectory()
+
+
+class CdnConnection(Connection):
+    # Resolves CDN DCs from the server config and everything else from
+    # pyrogram's table.
+    def __init__(
+        self, dc_id: int, test_mode: bool, ipv6: bool, alt_port: bool, proxy: dict,
+        media: bool = False, protocol_factory=TCPAbridged
+    ):
+        address = cdn_directory.address(dc_id, ipv6)
+        if address is None:
+            super().__init__(dc_id, test_mode, ipv6, alt_port, proxy, media, protocol_factory)
+            return
+        self.dc_id = dc_id
+        self.test_mode = test_mode
+        self.ipv6 = ipv6
+        self.alt_port = alt_port
+        self.proxy = proxy
+        self.media = media
+        self.protocol_factory = protocol_factory
+        self.address = address
+        self.protocol = None
+
+
+class CdnFile:
+    # A file the master DC redirected to a CDN DC. The CDN returns parts
+    # encrypted with AES-256-CTR under a per-file key, and every block is
+    # checked against the SHA-256 hashes the master DC hands out
+    # (https://core.telegram.org/cdn).
+    def __init__(self, redirect: raw.types.upload.FileCdnRedirect):
+        self.dc_id = redirect.dc_id
+        self.file_token = redirect.file_token
+        self.encryption_key = redirect.encryption_key
+        self.encryption_iv = redirect.encryption_iv
+        self.hashes: Dict[int, raw.types.FileHash] = {}
+        self.add_hashes(redirect.file_hashes)
+
+    def add_hashes(self, hashes: List[raw.types.FileHash]) -> None:
+        for file_hash in hashes or []:
+            self.hashes[file_hash.offset] = file_hash
+
+    async def fetch(self, media_session: Session, cdn_session: Session, offset: int, limit: int) -> bytes:
+        start, size = offset, limit
+        if limit < HASH_BLOCK:
+            start, size = offset - offset % HASH_BLOCK, HASH_BLOCK
+
+        for _ in range(MAX_REUPLOADS):
+            r = await cdn_session.send(
+                raw.functions.upload.GetCdnFile(file_token=self.file_token, offset=start, limit=size)
+            )
+            if not isinstance(r, raw.types.upload.CdnFileReuploadNeeded):
+                break
+            # The CDN does not hold the file (anymore); the master DC pushes
+            # it there and answers with fresh hashes.
+            self.add_hashes(await media_session.send(
+                raw.functions.upload.ReuploadCdnFile(file_token=self.file_token, request_token=r.request_token)
+            ))
+        else:
+            raise CDNFileHashMismatch(f"CDN DC {self.dc_id} kept asking for a reupload")
+
+        data = aes.ctr256_decrypt(
+            r.bytes,
+            self.encryption_key,
+            bytearray(self.encryption_iv[:-4] + (start // 16).to_bytes(4, "big"))
+        )
+        await self.verify(media_session, start, data)
+        return data[offset - start:offset - start + limit]
+
+    async def verify(self, media_session: Session, start: int, data: bytes) -> None:
+        position = start
+        while position < start + len(data):
+            file_hash = self.hashes.get(position)
+            if file_hash is None:
+                self.add_hashes(await media_session.send(
+                    raw.functions.upload.GetCdnFileHashes(file_token=self.file_token, offset=position)
+                ))
+                file_hash = self.hashes.get(position)
+            if file_hash is None or file_hash.limit <= 0:
+                raise CDNFileHashMismatch(f"No hash for CDN block at {position}")
+            block = data[position - start:position - start + file_hash.limit]
+            if sha256(block).digest() != file_hash.hash:
+                raise CDNFileHashMismatch(f"CDN block at {position} does not match its hash")
+            position += file_hash.limit
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from Backend.config import Telegram
+from Backend.logger import LOGGER
+
+
+PART_SIZE = 1024 * 1024
+SLOTS_PER_SEGMENT = 64
+
+# magic, media_id, offset, length, crc32
+HEADER = struct.Struct(">4sqqII4x")
+MAGIC = b"TGCC"
+SLOT_SIZE = HEADER.size + PART_SIZE
+
+# Disk reads, writes and CRCs run here so a slow disk never stalls the
+# event loop.
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chunk_cache")
+
+
+class ChunkCache:
+    # LRU cache of whole 1 MiB Telegram parts, stored in fixed-size slots of
+    # segment files. Every slot starts with a header carrying its key and a
+    # CRC32 of the payload, so the index can be rebuilt from disk on startup
+    # and corrupt slots are dropped on read. The index lives on the event
+    # loop; slot IO happens on the executor with pread/pwrite, and a slot
+    # being written belongs to neither the index nor the free list.
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.segment_count = max_bytes // (SLOTS_PER_SEGMENT * PART_SIZE)
+        self.enabled = self.segment_count > 0
+        self.segments: List[int] = []
+        self.index: "OrderedDict[Tuple[int, int], Tuple[int, int, int]]" = OrderedDict()
+        self.free_slots: List[int] = []
+        self.writing: Set[Tuple[int, int]] = set()
+        self.pending: Set[asyncio.Task] = set()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "corrupt": 0}
+        self._opening: Optional[asyncio.Future] = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+    async def _ensure_open(self) -> bool:
+        if self._opening is None:
+            self._opening = asyncio.ensure_future(self._run(self._open))
+        await asyncio.shield(self._opening)
+        return self.enabled
+
+    def _open(self) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for number in range(self.segment_count):
+                path = os.path.join(self.directory, f"segment_{number}.bin")
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+                self.segments.append(fd)
+                if os.fstat(fd).st_size != SLOTS_PER_SEGMENT * SLOT_SIZE:
+                    os.ftruncate(fd, SLOTS_PER_SEGMENT * SLOT_SIZE)
+        except OSError as e:
+            LOGGER.error(f"Chunk cache disabled, could not open {self.directory}: {e}")
+            self.enabled = False
+            return
+
+        for slot in range(self.segment_count * SLOTS_PER_SEGMENT):
+            fd, position = self._locate(slot)
+            magic, media_id, offset, length, crc = HEADER.unpack(os.pread(fd, HEADER.size, position))
+            if magic == MAGIC and length <= PART_SIZE:
+                self.index[(media_id, offset)] = (slot, length, crc)
+            else:
+                self.free_slots.append(slot)
+        LOGGER.info(f"Chunk cache ready: {len(self.index)} parts restored, {len(self.free_slots)} free slots")
+
+    def _locate(self, slot: int) -> Tuple[int, int]:
+        return self.segments[slot // SLOTS_PER_SEGMENT], (slot % SLOTS_PER_SEGMENT) * SLOT_SIZE
+
+    def _read(self, slot: int, length: int, crc: int) -> Optional[bytes]:
+        fd, position = self._locate(slot)
+        data = os.pread(fd, length, position + HEADER.size)
+        return data if len(data) == length and zlib.crc32(data) == crc else None
+
+    def _write(self, slot: int, media_id: int, offset: int, data: bytes) -> int:
+        fd, position = self._locate(slot)
+        crc = zlib.crc32(data)
+        # Payload first, header last: a half-written slot never looks valid.
+        os.pwrite(fd, HEADER.pack(b"\0" * 4, 0, 0, 0, 0), position)
+        os.pwrite(fd, data, position + HEADER.size)
+        os.pwrite(fd, HEADER.pack(MAGIC, media_id, offset, len(data), crc), position)
+        return crc
+
+    def _clear(self, slot: int) -> None:
+        fd, position = self._locate(slot)
+        os.pwrite(fd, HEADER.pack(b"\0" * 4, 0, 0, 0, 0), position)
+
+    async def get(self, media_id: int, offset: int) -> Optional[bytes]:
+        if not self.enabled or not await self._ensure_open():
+            return None
+        key = (media_id, offset)
+        entry = self.index.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        data = await self._run(self._read, *entry)
+        if data is None:
+            # A slot evicted and reused while it was being read is a miss,
+            # not corruption.
+            if self.index.get(key) != entry:
+                self.stats["misses"] += 1
+                return None
+            LOGGER.warning(f"Dropping corrupt cached part {media_id}@{offset}")
+            self.stats["corrupt"] += 1
+            await self._discard(key)
+            return None
+        if key in self.index:
+            self.index.move_to_end(key)
+        self.stats["hits"] += 1
+        return data
+
+    def has(self, media_id: int, offset: int) -> bool:
+        return (media_id, offset) in self.index
+
+    async def put(self, media_id: int, offset: int, data: bytes) -> None:
+        if not self.enabled or not data or len(data) > PART_SIZE:
+            return
+        if not await self._ensure_open():
+            return
+        key = (media_id, offset)
+        if key in self.index:
+            self.index.move_to_end(key)
+            return
+        if key in self.writing:
+            return
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        elif self.index:
+            _, (slot, _, _) = self.index.popitem(last=False)
+            self.stats["evictions"] += 1
+        else:
+            return
+        self.writing.add(key)
+        try:
+            crc = await self._run(self._write, slot, media_id, offset, bytes(data))
+        except OSError as e:
+            LOGGER.warning(f"Could not cache part {media_id}@{offset}: {e}")
+            self.free_slots.append(slot)
+        else:
+            self.index[key] = (slot, len(data), crc)
+        finally:
+            self.writing.discard(key)
+
+    def put_later(self, media_id: int, offset: int, data: bytes) -> None:
+        # Writes in the background so callers do not wait on the disk.
+        if not self.enabled:
+            return
+        task = asyncio.create_task(self.put(media_id, offset, data))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def _discard(self, key: Tuple[int, int]) -> None:
+        entry = self.index.pop(key, None)
+        if entry is None:
+            return
+        await self._run(self._clear, entry[0])
+        self.free_slots.append(entry[0])
+
+    def close(self) -> None:
+        for fd in self.segments:
+            os.close(fd)
+        self.segments.clear()
+        self.index.clear()
+        self.free_slots.clear()
+        self._opening = None
+
+
+class SegmentCache:
+    # RAM-resident head and tail parts of files. Players probe these first
+    # for the container header, moov atom or Cues, so they are kept apart
+    # from the disk LRU and only dropped as whole files once the budget of
+    # pinned bytes is exceeded.
+    def __init__(self, max_bytes: int, head_parts: int, tail_parts: int):
+        self.max_bytes = max_bytes
+        self.head_parts = head_parts
+        self.tail_parts = tail_parts
+        self.files: "OrderedDict[int, Dict[int, bytes]]" = OrderedDict()
+        self.size = 0
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and (self.head_parts > 0 or self.tail_parts > 0)
+
+    def offsets(self, file_size: int) -> List[int]:
+        last_part = max(0, (file_size - 1) // PART_SIZE)
+        head = range(0, min(self.head_parts, last_part + 1))
+        tail = range(max(0, last_part - self.tail_parts + 1), last_part + 1)
+        return [part * PART_SIZE for part in sorted(set(head) | set(tail))]
+
+    def covers(self, file_size: int, offset: int) -> bool:
+        if not self.enabled or offset % PART_SIZE:
+            return False
+        part = offset // PART_SIZE
+        last_part = max(0, (file_size - 1) // PART_SIZE)
+        return part < self.head_parts or part > last_part - self.tail_parts
+
+    def get(self, media_id: int, offset: int) -> Optional[bytes]:
+        parts = self.files.get(media_id)
+        chunk = parts.get(offset) if parts else None
+        if chunk is None:
+            self.stats["misses"] += 1
+            return None
+        self.files.move_to_end(media_id)
+        self.stats["hits"] += 1
+        return chunk
+
+    def has(self, media_id: int, offset: int) -> bool:
+        return offset in self.files.get(media_id, {})
+
+    def put(self, media_id: int, offset: int, data: bytes) -> None:
+        if not self.enabled or not data:
+            return
+        parts = self.files.setdefault(media_id, {})
+        self.files.move_to_end(media_id)
+        if offset in parts:
+            return
+        parts[offset] = data
+        self.size += len(data)
+        while self.size > self.max_bytes and len(self.files) > 1:
+            _, evicted = self.files.popitem(last=False)
+            self.size -= sum(len(chunk) for chunk in evicted.values())
+            self.stats["evictions"] += 1
+
+
+chunk_cache = ChunkCache(Telegram.CHUNK_CACHE_DIR, Telegram.CHUNK_CACHE_MB * 1024 * 1024)
+segment_cache = SegmentCache(Telegram.PINNED_CACHE_MB * 1024 * 1024, Telegram.PINNED_HEAD_PARTS, Telegram.PINNED_TAIL_PARTS)
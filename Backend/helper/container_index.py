@@ -0,0 +1,301 @@
+import struct
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple
+from Backend.helper.single_flight import SingleFlight
+from Backend.logger import LOGGER
+
+
+Reader = Callable[[int, int], Awaitable[bytes]]
+
+HEAD_BYTES = 64 * 1024
+MAX_CUES_BYTES = 16 * 1024 * 1024
+MAX_MOOV_BYTES = 64 * 1024 * 1024
+MAX_TOP_LEVEL_BOXES = 64
+
+# Matroska element ids
+EBML = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TIME = 0xB3
+CUE_TRACK_POSITIONS = 0xB7
+CUE_CLUSTER_POSITION = 0xF1
+CLUSTER = 0x1F43B675
+
+
+class ContainerIndex:
+    # Seek points of a file, MKV clusters from the Cues or MP4 chunks that
+    # start a keyframe, as (seconds, byte offset) sorted by offset.
+    def __init__(self, entries: List[Tuple[float, int]], file_size: int):
+        entries = sorted(set(e for e in entries if 0 <= e[1] < file_size), key=lambda e: e[1])
+        self.times = [time for time, _ in entries]
+        self.offsets = [offset for _, offset in entries]
+        self.file_size = file_size
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def span(self, offset: int) -> Tuple[int, int]:
+        # Byte range of the cluster holding `offset`.
+        i = bisect_right(self.offsets, offset) - 1
+        start = self.offsets[i] if i >= 0 else 0
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.file_size
+        return start, end
+
+
+def read_vint(data: bytes, pos: int, keep_marker: bool = False) -> Tuple[int, int]:
+    first = data[pos]
+    length = next((i + 1 for i in range(8) if first & (0x80 >> i)), 0)
+    if not length:
+        raise ValueError(f"invalid EBML variable-size integer at {pos}")
+    if pos + length > len(data):
+        raise IndexError("truncated EBML integer")
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    return value, length
+
+
+def read_element(data: bytes, pos: int) -> Tuple[int, Optional[int], int]:
+    element_id, id_length = read_vint(data, pos, keep_marker=True)
+    size, size_length = read_vint(data, pos + id_length)
+    if size == (1 << (7 * size_length)) - 1:
+        size = None
+    return element_id, size, id_length + size_length
+
+
+def elements(data: bytes, start: int, end: int) -> Iterator[Tuple[int, int, int]]:
+    pos = start
+    while pos < end:
+        element_id, size, header = read_element(data, pos)
+        data_start = pos + header
+        data_end = end if size is None else data_start + size
+        yield element_id, data_start, data_end
+        pos = data_end
+
+
+def read_uint(data: bytes, start: int, end: int) -> int:
+    return int.from_bytes(data[start:end], "big")
+
+
+async def mkv_index(read: Reader, head: bytes, file_size: int) -> Optional[ContainerIndex]:
+    element_id, size, header = read_element(head, 0)
+    if element_id != EBML or size is None:
+        return None
+    pos = header + size
+    element_id, _, header = read_element(head, pos)
+    if element_id != SEGMENT:
+        return None
+    segment_start = pos + header
+
+    seeks = {}
+    scale = 1_000_000
+    cues = None
+    try:
+        for element_id, start, end in elements(head, segment_start, len(head)):
+            if element_id == CLUSTER or end > len(head):
+                break
+            if element_id == SEEK_HEAD:
+                for seek_id, seek_start, seek_end in elements(head, start, end):
+                    if seek_id != SEEK:
+                        continue
+                    fields = {i: (s, e) for i, s, e in elements(head, seek_start, seek_end)}
+                    if SEEK_ID in fields and SEEK_POSITION in fields:
+                        seeks[read_uint(head, *fields[SEEK_ID])] = read_uint(head, *fields[SEEK_POSITION])
+            elif element_id == INFO:
+                for info_id, info_start, info_end in elements(head, start, end):
+                    if info_id == TIMESTAMP_SCALE:
+                        scale = read_uint(head, info_start, info_end)
+            elif element_id == CUES:
+                cues = head[start:end]
+    except (IndexError, ValueError):
+        # Whatever follows the last complete element is outside the head.
+        pass
+
+    if cues is None:
+        if CUES not in seeks:
+            return None
+        position = segment_start + seeks[CUES]
+        element_id, size, header = read_element(await read(position, 16), 0)
+        if element_id != CUES or size is None or size > MAX_CUES_BYTES:
+            return None
+        cues = await read(position + header, size)
+
+    entries = []
+    for element_id, start, end in elements(cues, 0, len(cues)):
+        if element_id != CUE_POINT:
+            continue
+        time = cluster = None
+        for field_id, field_start, field_end in elements(cues, start, end):
+            if field_id == CUE_TIME:
+                time = read_uint(cues, field_start, field_end)
+            elif field_id == CUE_TRACK_POSITIONS and cluster is None:
+                for position_id, position_start, position_end in elements(cues, field_start, field_end):
+                    if position_id == CUE_CLUSTER_POSITION:
+                        cluster = read_uint(cues, position_start, position_end)
+        if time is not None and cluster is not None:
+            entries.append((time * scale / 1e9, segment_start + cluster))
+    return ContainerIndex(entries, file_size)
+
+
+def boxes(data: bytes, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield box_type, pos + header, min(pos + size, end)
+        pos += size
+
+
+def find_box(data: bytes, start: int, end: int, *path: bytes) -> Optional[Tuple[int, int]]:
+    for name in path:
+        found = next(((s, e) for box_type, s, e in boxes(data, start, end) if box_type == name), None)
+        if found is None:
+            return None
+        start, end = found
+    return start, end
+
+
+def table(data: bytes, box: Optional[Tuple[int, int]], fields: str) -> List[tuple]:
+    if box is None:
+        return []
+    start, _ = box
+    count = struct.unpack_from(">I", data, start + 4)[0]
+    entry = struct.Struct(">" + fields)
+    return list(entry.iter_unpack(data[start + 8:start + 8 + count * entry.size]))
+
+
+def parse_moov(moov: bytes, file_size: int) -> Optional[ContainerIndex]:
+    for box_type, start, end in boxes(moov, 0, len(moov)):
+        if box_type != b"trak":
+            continue
+        hdlr = find_box(moov, start, end, b"mdia", b"hdlr")
+        if hdlr is None or moov[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+            continue
+        mdhd = find_box(moov, start, end, b"mdia", b"mdhd")
+        stbl = find_box(moov, start, end, b"mdia", b"minf", b"stbl")
+        if mdhd is None or stbl is None:
+            return None
+        timescale = struct.unpack_from(">I", moov, mdhd[0] + (20 if moov[mdhd[0]] == 1 else 12))[0] or 1
+
+        offsets = [o for o, in table(moov, find_box(moov, *stbl, b"stco"), "I")]
+        offsets = offsets or [o for o, in table(moov, find_box(moov, *stbl, b"co64"), "Q")]
+        stsc = table(moov, find_box(moov, *stbl, b"stsc"), "III")
+        stts = table(moov, find_box(moov, *stbl, b"stts"), "II")
+        sync = [s - 1 for s, in table(moov, find_box(moov, *stbl, b"stss"), "I")]
+        if not offsets or not stsc:
+            return None
+
+        # First sample of every chunk, from the sample-to-chunk runs.
+        first_samples = []
+        sample = 0
+        for i, (first_chunk, per_chunk, _) in enumerate(stsc):
+            last_chunk = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(offsets)
+            for _ in range(first_chunk, last_chunk + 1):
+                first_samples.append(sample)
+                sample += per_chunk
+        first_samples = first_samples[:len(offsets)]
+
+        # Only chunks holding a keyframe are useful seek points.
+        chunks = range(len(first_samples))
+        if sync:
+            keyed, s = [], 0
+            for chunk in chunks:
+                chunk_end = first_samples[chunk + 1] if chunk + 1 < len(first_samples) else sample
+                while s < len(sync) and sync[s] < first_samples[chunk]:
+                    s += 1
+                if s < len(sync) and sync[s] < chunk_end:
+                    keyed.append(chunk)
+            chunks = keyed
+
+        entries = []
+        runs = iter(stts)
+        run_count, run_delta = next(runs, (0, 0))
+        run_start = time = 0
+        for chunk in chunks:
+            target = first_samples[chunk]
+            while run_count and target >= run_start + run_count:
+                time += run_count * run_delta
+                run_start += run_count
+                run_count, run_delta = next(runs, (0, 0))
+            entries.append(((time + (target - run_start) * run_delta) / timescale, offsets[chunk]))
+        return ContainerIndex(entries, file_size)
+    return None
+
+
+async def mp4_index(read: Reader, head: bytes, file_size: int) -> Optional[ContainerIndex]:
+    if head[4:8] != b"ftyp":
+        return None
+    pos = 0
+    for _ in range(MAX_TOP_LEVEL_BOXES):
+        if pos + 8 > file_size:
+            return None
+        header = head[pos:pos + 16] if pos + 16 <= len(head) else await read(pos, min(16, file_size - pos))
+        size, box_type = struct.unpack_from(">I4s", header)
+        start = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", header, 8)[0]
+            start = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < start:
+            return None
+        if box_type == b"moov":
+            if size > MAX_MOOV_BYTES:
+                return None
+            return parse_moov(await read(pos + start, size - start), file_size)
+        pos += size
+    return None
+
+
+async def build_index(read: Reader, file_size: int) -> Optional[ContainerIndex]:
+    head = await read(0, min(HEAD_BYTES, file_size))
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return await mkv_index(read, head, file_size)
+    return await mp4_index(read, head, file_size)
+
+
+class ContainerIndexCache:
+    # Indexes are built once per file; files that are not MKV or MP4, or
+    # whose index cannot be parsed, are remembered as None so they are not
+    # probed again. Fetch errors are not cached.
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[int, Optional[ContainerIndex]]" = OrderedDict()
+        self.flights = SingleFlight()
+
+    async def get(self, media_id: int, file_size: int, read: Reader) -> Optional[ContainerIndex]:
+        if media_id in self.entries:
+            self.entries.move_to_end(media_id)
+            return self.entries[media_id]
+        return await self.flights.do(media_id, lambda: self.load(media_id, file_size, read))
+
+    async def load(self, media_id: int, file_size: int, read: Reader) -> Optional[ContainerIndex]:
+        try:
+            index = await build_index(read, file_size)
+        except (ValueError, IndexError, struct.error) as e:
+            LOGGER.debug(f"Could not index container of {media_id}: {e}")
+            index = None
+        if index is not None and not len(index):
+            index = None
+        self.entries[media_id] = index
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return index
+
+
+container_indexes = ContainerIndexCache(256)
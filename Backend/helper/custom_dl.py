@@ -1,114 +1,670 @@
 import asyncio
+from collections import OrderedDict, deque
 from pyrogram import utils, raw
-from pyrogram.errors import AuthBytesInvalid
+from pyrogram.errors import (
+    FileReferenceExpired, FileReferenceInvalid, FloodWait,
+    InternalServerError, ServiceUnavailable
+)
 from pyrogram.file_id import FileId, FileType, ThumbnailSource
-from pyrogram.session import Session, Auth
-from typing import Dict, Union
+from pyrogram.session import Session
+from time import monotonic
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple, Union
+from Backend.config import Telegram
 from Backend.logger import LOGGER
-from Backend.helper.exceptions import FIleNotFound
-from Backend.helper.pyro import get_file_ids
-from Backend.pyrofork.bot import work_loads
+from Backend.helper.cdn import CdnFile
+from Backend.helper.chunk_cache import PART_SIZE, chunk_cache, segment_cache
+from Backend.helper.container_index import ContainerIndex, container_indexes
+from Backend.helper.exceptions import BudgetExhausted, FIleNotFound
+from Backend.helper.file_cache import file_cache
+from Backend.helper.metrics import flood_waits, getfile_errors, getfile_seconds
+from Backend import db
+from Backend.helper.pyro import get_file_ids, file_id_from_location, file_id_to_location
+from Backend.helper.session_pool import session_pool
+from Backend.helper.single_flight import part_flights
+from Backend.pyrofork.bot import multi_clients
+from Backend.pyrofork.scheduler import scheduler
 from pyrogram import Client, utils, raw
 
 
+class ReadAheadBudget:
+    # Bytes requested ahead of the consumer, shared by every stream so memory
+    # stays bounded no matter how many viewers are connected.
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+
+    def try_acquire(self, size: int) -> bool:
+        if self.in_flight + size > self.max_bytes:
+            return False
+        self.in_flight += size
+        return True
+
+    def release(self, size: int) -> None:
+        self.in_flight = max(0, self.in_flight - size)
+
+
+read_ahead_budget = ReadAheadBudget(Telegram.PREFETCH_MAX_MB * 1024 * 1024)
+
+MAX_PART_RETRIES = 5
+MAX_FLOOD_SLEEP = 30
+# Base delay before retrying a part on the same session after a server-side
+# error or timeout; doubled on every attempt.
+RETRY_BACKOFF = 0.5
+RECOVERABLE_ERRORS = (
+    FileReferenceExpired, FileReferenceInvalid, FloodWait,
+    InternalServerError, ServiceUnavailable, OSError, TimeoutError
+)
+MAX_CDN_FILES = 1024
+recovery_stats: Dict[str, int] = {"retries": 0, "failovers": 0, "reference_refreshes": 0, "session_replacements": 0}
+
+
+# upload.GetFile wants limit to divide 1 MiB and the part not to cross a
+# 1 MiB boundary; power-of-two sizes at offsets aligned to their own size
+# satisfy both.
+MIN_PART_SIZE = 4096
+
+
+def part_size(size: int) -> int:
+    size = max(MIN_PART_SIZE, min(PART_SIZE, size))
+    return 1 << (size - 1).bit_length()
+
+
+def plan_parts(ranges: List[Tuple[int, int]], min_part: int = PART_SIZE) -> List[Tuple[int, int]]:
+    # (offset, limit) parts covering the given sorted, non-overlapping
+    # inclusive byte ranges. Every range starts with `min_part` sized parts,
+    # which is what a seek needs, and doubles the size part by part up to
+    # PART_SIZE for sequential reads. Short tails are not rounded up to a
+    # whole part, and bytes a previous part already covers are not fetched
+    # again.
+    min_part = part_size(min_part)
+    parts = []
+    covered = 0
+    for start, end in ranges:
+        offset = max(start - start % min_part, covered)
+        grow = min_part
+        while offset <= end:
+            limit = min(grow, part_size(end + 1 - offset))
+            while offset % limit:
+                limit //= 2
+            parts.append((offset, limit))
+            offset += limit
+            grow = min(PART_SIZE, grow * 2)
+        covered = max(covered, offset)
+    return parts
+
+
+class ReadAhead:
+    # Keeps up to `depth` GetFile calls in flight ahead of the part being
+    # yielded. The window grows while the consumer is left waiting on the
+    # network and shrinks while finished parts pile up unread.
+    def __init__(self, fetch: Callable[[int, int], Awaitable[bytes]], parts: List[Tuple[int, int]], lanes: int = 1):
+        self.fetch = fetch
+        self.parts: Deque[Tuple[int, int]] = deque()
+        self.end = 0
+        self.min_depth = lanes
+        self.max_depth = max(1, Telegram.PREFETCH_PARTS) * lanes
+        self.depth = lanes
+        self.window: Deque[Tuple[asyncio.Task, int, int, int]] = deque()
+        self.last: Optional[Tuple[int, bytes]] = None
+        self.replay = False
+        self.extend(parts)
+
+    def extend(self, parts: List[Tuple[int, int]]) -> None:
+        if parts:
+            self.parts.extend(parts)
+            offset, limit = parts[-1]
+            self.end = offset + limit
+        self._fill()
+
+    def extend_to(self, end: int) -> None:
+        # Continues the plan sequentially from where it currently stops.
+        if end >= self.end:
+            self.extend(plan_parts([(self.end, end)], self.end & -self.end or PART_SIZE))
+
+    def _fill(self) -> None:
+        while self.parts and len(self.window) < self.depth:
+            offset, limit = self.parts[0]
+            # The part about to be consumed is always requested; anything
+            # beyond it has to fit in the shared budget.
+            budgeted = limit if self.window else 0
+            if budgeted and not read_ahead_budget.try_acquire(budgeted):
+                break
+            self.parts.popleft()
+            task = asyncio.create_task(self.fetch(offset, limit))
+            self.window.append((task, offset, limit, budgeted))
+
+    def skip_to(self, offset: int) -> bool:
+        # Drops planned parts that end before `offset` and tells whether the
+        # next part then starts at or before it. A part already yielded that
+        # holds `offset` is handed out once more.
+        if self.last and self.last[0] <= offset < self.last[0] + len(self.last[1]):
+            self.replay = True
+            return True
+        while self.window or self.parts:
+            if self.window:
+                _, start, limit, _ = self.window[0]
+                if start + limit > offset:
+                    return start <= offset
+                self._drop(self.window.popleft())
+            else:
+                start, limit = self.parts[0]
+                if start + limit > offset:
+                    return start <= offset
+                self.parts.popleft()
+        return False
+
+    async def next(self) -> Tuple[int, bytes]:
+        if self.replay:
+            self.replay = False
+            return self.last
+        self._fill()
+        if not self.window:
+            return -1, b""
+        task, offset, _, budgeted = self.window[0]
+        if not task.done():
+            self.depth = min(self.max_depth, self.depth + 1)
+        elif len(self.window) > 1 and self.window[1][0].done():
+            self.depth = max(self.min_depth, self.depth - 1)
+        try:
+            chunk = await task
+        finally:
+            self.window.popleft()
+            read_ahead_budget.release(budgeted)
+        self._fill()
+        self.last = (offset, chunk)
+        return offset, chunk
+
+    @staticmethod
+    def _drop(entry: Tuple[asyncio.Task, int, int, int]) -> None:
+        task, _, _, budgeted = entry
+        if task.done() and not task.cancelled():
+            task.exception()
+        task.cancel()
+        read_ahead_budget.release(budgeted)
+
+    def close(self) -> None:
+        while self.window:
+            self._drop(self.window.popleft())
+        self.parts.clear()
+        self.last = None
+
+
+class StripeLane:
+    def __init__(self, streamer: "ByteStreamer", media_session: Session):
+        self.streamer = streamer
+        self.media_session = media_session
+        self.in_flight = 0
+
+    @property
+    def index(self) -> int:
+        return self.streamer.index
+
+    @property
+    def speed(self) -> float:
+        return scheduler.speed(self.streamer.index, self.media_session.dc_id)
+
+
+class StripedFetcher:
+    # Spreads consecutive parts of one range over several clients. Each part
+    # goes to the lane whose queue would drain first given its measured
+    # throughput, so faster bots carry a proportionally larger share.
+    #
+    # A part that fails is retried from the same offset after recovering:
+    # an expired file reference is refreshed from the message, a broken
+    # session is replaced from the pool and a client in FloodWait is swapped
+    # for another one, so the HTTP response never sees the error.
+    def __init__(self, file_id: FileId, location, chat_id: Optional[int] = None, message_id: Optional[int] = None):
+        self.lanes: List[StripeLane] = []
+        self.file_id = file_id
+        self.location = location
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.refresh_lock = asyncio.Lock()
+
+    async def add_lane(self, index: int) -> bool:
+        streamer = get_streamer(index)
+        try:
+            media_session = await streamer.generate_media_session(streamer.client, self.file_id)
+        except Exception as e:
+            LOGGER.warning(f"Client {index} left out of stripe: {e}")
+            return False
+        if media_session is None:
+            return False
+        scheduler.acquire(index)
+        self.lanes.append(StripeLane(streamer, media_session))
+        return True
+
+    def drop_lane(self, lane: StripeLane) -> None:
+        if lane in self.lanes:
+            self.lanes.remove(lane)
+            scheduler.release(lane.index)
+
+    def close(self) -> None:
+        for lane in list(self.lanes):
+            self.drop_lane(lane)
+
+    async def __call__(self, offset: int, limit: int) -> bytes:
+        attempt = 0
+        while True:
+            if not self.lanes:
+                raise AttributeError("No client left to fetch from")
+            lane = min(self.lanes, key=lambda l: (l.in_flight + 1) / l.speed)
+            file_id, media_session = self.file_id, lane.media_session
+            lane.in_flight += 1
+            try:
+                return await lane.streamer.get_part(file_id, media_session, self.location, offset, limit)
+            except RECOVERABLE_ERRORS as e:
+                if attempt >= MAX_PART_RETRIES:
+                    raise
+                error = e
+            finally:
+                lane.in_flight -= 1
+            attempt += 1
+            recovery_stats["retries"] += 1
+            LOGGER.warning(f"Retrying part at {offset} on client {lane.index} after {type(error).__name__}")
+            await self.recover(lane, file_id, media_session, error, attempt)
+
+    async def recover(
+        self, lane: StripeLane, file_id: FileId, media_session: Session, error: Exception, attempt: int = 1
+    ) -> None:
+        if isinstance(error, (FileReferenceExpired, FileReferenceInvalid)):
+            async with self.refresh_lock:
+                if self.file_id is file_id and self.chat_id is not None:
+                    self.file_id = await lane.streamer.get_file_properties(self.chat_id, self.message_id, refresh=True)
+                    self.location = await ByteStreamer.get_location(self.file_id)
+                    recovery_stats["reference_refreshes"] += 1
+        elif isinstance(error, FloodWait):
+            await self.fail_over(lane, error.value)
+        elif media_session.is_started.is_set() and not (
+            isinstance(error, OSError) and not isinstance(error, TimeoutError)
+        ):
+            # 5xx answers and timeouts come over a working connection, and the
+            # session is shared with other streams; back off and retry on it.
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+        elif lane.media_session is media_session:
+            await session_pool.replace(lane.index, media_session)
+            recovery_stats["session_replacements"] += 1
+            try:
+                new_session = await lane.streamer.generate_media_session(lane.streamer.client, self.file_id)
+            except Exception:
+                new_session = None
+            if new_session is None:
+                await self.fail_over(lane)
+            else:
+                lane.media_session = new_session
+
+    async def fail_over(self, lane: StripeLane, wait: float = 0) -> None:
+        if lane not in self.lanes:
+            return
+        used = [l.index for l in self.lanes]
+        candidates = [i for i in scheduler.pick_many(len(multi_clients), self.file_id.dc_id, exclude=used) if scheduler.available(i)]
+        for index in candidates:
+            if await self.add_lane(index):
+                self.drop_lane(lane)
+                recovery_stats["failovers"] += 1
+                LOGGER.info(f"Stream failed over from client {lane.index} to client {index}")
+                return
+        if len(self.lanes) > 1:
+            self.drop_lane(lane)
+        elif wait and wait <= MAX_FLOOD_SLEEP:
+            await asyncio.sleep(wait)
+        elif wait:
+            raise AttributeError(f"Every client is in FloodWait for {wait}s")
+
+
+# Most a cluster warmer requests ahead of the reader.
+WARM_MAX_BYTES = 8 * PART_SIZE
+# Parts a container index read has in flight at once.
+INDEX_READ_PARTS = 4
+
+
+class ClusterWarmer:
+    # Uses the container index of MKV and MP4 files to fetch the rest of
+    # the cluster the reader is in and the whole next one into the chunk
+    # cache, so seeks and cluster boundaries land on data already fetched.
+    def __init__(self, file_id: FileId, fetch: Callable[[int, int], Awaitable[bytes]]):
+        self.file_id = file_id
+        self.fetch = fetch
+        self.index: Optional[ContainerIndex] = None
+        self.loader: Optional[asyncio.Task] = None
+        self.position = 0
+        self.warmed: Set[int] = set()
+        self.tasks: Set[asyncio.Task] = set()
+
+    def seek(self, offset: int) -> None:
+        self.position = offset
+        if self.index:
+            self._warm()
+        elif self.loader is None:
+            self.loader = asyncio.create_task(self._load())
+
+    def advance(self, position: int) -> None:
+        self.position = position
+        if self.index:
+            self._warm()
+
+    async def _load(self) -> None:
+        try:
+            self.index = await container_indexes.get(self.file_id.media_id, self.file_id.file_size, self.read)
+        except BudgetExhausted as e:
+            # Not remembered; the next seek tries again.
+            LOGGER.debug(f"Container index of {self.file_id.media_id} deferred: {e}")
+            self.loader = None
+            return
+        except (AttributeError,) + RECOVERABLE_ERRORS as e:
+            LOGGER.debug(f"Container index of {self.file_id.media_id} unavailable: {e}")
+            return
+        if self.index:
+            self._warm()
+
+    async def read(self, offset: int, length: int) -> bytes:
+        # A moov or Cues read holds its whole span until it is parsed, so it
+        # is charged to the shared read-ahead budget and fetched a few parts
+        # at a time.
+        first = offset - offset % PART_SIZE
+        offsets = range(first, offset + length, PART_SIZE)
+        size = len(offsets) * PART_SIZE
+        if not read_ahead_budget.try_acquire(size):
+            raise BudgetExhausted(f"no read-ahead budget left for a {size} byte index read")
+        try:
+            parts = []
+            for i in range(0, len(offsets), INDEX_READ_PARTS):
+                parts += await asyncio.gather(*(self.fetch(part, PART_SIZE) for part in offsets[i:i + INDEX_READ_PARTS]))
+            return b"".join(parts)[offset - first:offset - first + length]
+        finally:
+            read_ahead_budget.release(size)
+
+    def _warm(self) -> None:
+        file_size = self.file_id.file_size
+        _, end = self.index.span(self.position)
+        next_end = self.index.span(end)[1] if end < file_size else end
+        stop = min(next_end, self.position + WARM_MAX_BYTES)
+        # The part being read is the read-ahead's business.
+        for offset in range(self.position - self.position % PART_SIZE + PART_SIZE, stop, PART_SIZE):
+            if offset in self.warmed or chunk_cache.has(self.file_id.media_id, offset):
+                continue
+            if not read_ahead_budget.try_acquire(PART_SIZE):
+                break
+            self.warmed.add(offset)
+            task = asyncio.create_task(self.fetch(offset, PART_SIZE))
+            task.add_done_callback(self._done)
+            self.tasks.add(task)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        read_ahead_budget.release(PART_SIZE)
+        if not task.cancelled():
+            task.exception()
+
+    def close(self) -> None:
+        if self.loader:
+            self.loader.cancel()
+        for task in list(self.tasks):
+            task.cancel()
+
+
+class StreamCursor:
+    # Upstream side of one stream: the clients and sessions fetching it and
+    # the parts already requested ahead of the reader.
+    def __init__(self, fetcher: StripedFetcher, read_ahead: ReadAhead):
+        self.fetcher = fetcher
+        self.read_ahead = read_ahead
+        self.warmer: Optional[ClusterWarmer] = None
+        self.expiry: Optional[asyncio.TimerHandle] = None
+
+    def close(self) -> None:
+        if self.expiry:
+            self.expiry.cancel()
+            self.expiry = None
+        if self.warmer:
+            self.warmer.close()
+        self.read_ahead.close()
+        self.fetcher.close()
+
+
+class CursorRegistry:
+    # Players often read a file as a run of adjacent range requests. When a
+    # range is served completely its cursor keeps prefetching for a short
+    # grace period, keyed by viewer and file, and a request that continues
+    # where it stopped takes it over instead of starting from scratch.
+    def __init__(self, grace: float):
+        self.grace = grace
+        self.cursors: Dict[Tuple, StreamCursor] = {}
+        self.stats: Dict[str, int] = {"parked": 0, "resumed": 0, "expired": 0}
+
+    def park(self, key: Tuple, cursor: StreamCursor) -> None:
+        if self.grace <= 0:
+            cursor.close()
+            return
+        previous = self.cursors.pop(key, None)
+        if previous:
+            previous.close()
+        cursor.expiry = asyncio.get_running_loop().call_later(self.grace, self.expire, key, cursor)
+        self.cursors[key] = cursor
+        self.stats["parked"] += 1
+
+    def expire(self, key: Tuple, cursor: StreamCursor) -> None:
+        cursor.expiry = None
+        if self.cursors.get(key) is cursor:
+            del self.cursors[key]
+            self.stats["expired"] += 1
+        cursor.close()
+
+    def take(self, key: Tuple, offset: int) -> Optional[StreamCursor]:
+        cursor = self.cursors.pop(key, None)
+        if cursor is None:
+            return None
+        if cursor.expiry:
+            cursor.expiry.cancel()
+            cursor.expiry = None
+        if not cursor.read_ahead.skip_to(offset):
+            cursor.close()
+            return None
+        self.stats["resumed"] += 1
+        return cursor
+
+    def close(self) -> None:
+        for cursor in self.cursors.values():
+            cursor.close()
+        self.cursors.clear()
+
+
+stream_cursors = CursorRegistry(Telegram.CURSOR_GRACE)
+
+
 class ByteStreamer:
-    def __init__(self, client: Client):
-        self.clean_timer = 30 * 60
+    def __init__(self, client: Client, index: int = 0):
         self.client: Client = client
-        self.__cached_file_ids: Dict[int, FileId] = {}
-        asyncio.create_task(self.clean_cache())
-
-    async def get_file_properties(self, chat_id: int, message_id: int) -> FileId:
-        if message_id not in self.__cached_file_ids:
-            file_id = await get_file_ids(self.client, int(chat_id), int(message_id))
-            if not file_id:
-                LOGGER.info('Message with ID %s not found!', message_id)
-                raise FIleNotFound
-            self.__cached_file_ids[message_id] = file_id
-        return self.__cached_file_ids[message_id]
-
-    async def yield_file(self, file_id: FileId, index: int, offset: int, first_part_cut: int, last_part_cut: int, part_count: int, chunk_size: int) -> Union[str, None]: # type: ignore
-        client = self.client
-        work_loads[index] += 1
-        LOGGER.debug(f"Starting to yielding file with client {index}.")
-        media_session = await self.generate_media_session(client, file_id)
-        current_part = 1
-        location = await self.get_location(file_id)
-        try:
-            r = await media_session.send(raw.functions.upload.GetFile(location=location, offset=offset, limit=chunk_size))
-            if isinstance(r, raw.types.upload.File):
-                while True:
-                    chunk = r.bytes
-                    if not chunk:
-                        break
-                    elif part_count == 1:
-                        yield chunk[first_part_cut:last_part_cut]
-                    elif current_part == 1:
-                        yield chunk[first_part_cut:]
-                    elif current_part == part_count:
-                        yield chunk[:last_part_cut]
-                    else:
-                        yield chunk
+        self.index = index
+        self.cdn_files: "OrderedDict[int, CdnFile]" = OrderedDict()
+        self.cdn_blocked: Set[int] = set()
+
+    async def get_file_properties(self, chat_id: int, message_id: int, refresh: bool = False) -> FileId:
+        key = (int(chat_id), int(message_id))
+        if refresh:
+            file_cache.invalidate(key)
+        return await file_cache.get_or_load(key, lambda: self.load_file_properties(*key, refresh=refresh))
+
+    async def load_file_properties(self, chat_id: int, message_id: int, refresh: bool = False) -> FileId:
+        location = None if refresh else await db.get_file_location(chat_id, message_id)
+        if location:
+            return file_id_from_location(location)
+        file_id = await get_file_ids(self.client, chat_id, message_id)
+        if not file_id:
+            LOGGER.info('Message with ID %s not found!', message_id)
+            raise FIleNotFound
+        await db.save_file_location(chat_id, message_id, file_id_to_location(file_id))
+        return file_id
 
-                    current_part += 1
-                    offset += chunk_size
+    async def open_cursor(self, file_id: FileId, index: int, parts: List[Tuple[int, int]], stripe: Optional[List[int]] = None, chat_id: Optional[int] = None, message_id: Optional[int] = None) -> Optional[StreamCursor]:
+        indexes = [index] + [i for i in (stripe or []) if i != index]
+        LOGGER.debug(f"Starting to yielding file with clients {indexes}.")
+        fetcher = StripedFetcher(file_id, await self.get_location(file_id), chat_id, message_id)
+        for i in indexes:
+            await fetcher.add_lane(i)
+        if not fetcher.lanes:
+            fetcher.close()
+            return None
+        return StreamCursor(fetcher, ReadAhead(fetcher, parts, lanes=len(fetcher.lanes)))
 
-                    if current_part > part_count:
+    async def yield_ranges(self, file_id: FileId, index: int, ranges: List[Tuple[int, int]], stripe: Optional[List[int]] = None, chat_id: Optional[int] = None, message_id: Optional[int] = None, client_key: Optional[Tuple] = None):
+        # `ranges` must be sorted and non-overlapping; yields (range number,
+        # bytes or memoryview) pieces in order while every part is fetched
+        # only once. Single ranges from a known `client_key` may continue a
+        # parked cursor and park their own once served.
+        last = ranges[-1][1]
+        key = (client_key, file_id.media_id) if client_key and len(ranges) == 1 else None
+        cursor = stream_cursors.take(key, ranges[0][0]) if key else None
+        if cursor:
+            LOGGER.debug(f"Resuming stream of {file_id.media_id} at {ranges[0][0]}")
+            cursor.read_ahead.extend_to(last)
+        else:
+            parts = plan_parts(ranges, Telegram.MIN_PART_KB * 1024)
+            cursor = await self.open_cursor(file_id, index, parts, stripe, chat_id, message_id)
+            if cursor is None:
+                return
+        if len(ranges) == 1 and Telegram.CONTAINER_PREFETCH:
+            if cursor.warmer is None:
+                cursor.warmer = ClusterWarmer(file_id, cursor.fetcher)
+            cursor.warmer.seek(ranges[0][0])
+        first = 0
+        yielded = 0
+        served = False
+        try:
+            while not served:
+                offset, chunk = await cursor.read_ahead.next()
+                if not chunk:
+                    break
+                part_end = offset + len(chunk) - 1
+                served = part_end >= last
+                while first < len(ranges) and ranges[first][1] < offset:
+                    first += 1
+                for number in range(first, len(ranges)):
+                    start, end = ranges[number]
+                    if start > part_end:
                         break
-                    
-                    r = await media_session.send(
-                        raw.functions.upload.GetFile(
-                            location=location, offset=offset, limit=chunk_size
-                        ),
-                    )
-        except (TimeoutError, AttributeError):
-            pass
+                    if start <= offset and end >= part_end:
+                        yield number, chunk
+                    else:
+                        # Cut without copying; the part stays alive as long
+                        # as the view does.
+                        yield number, memoryview(chunk)[max(start, offset) - offset:min(end, part_end) - offset + 1]
+                yielded += 1
+                if cursor.warmer:
+                    cursor.warmer.advance(part_end + 1)
+        except (AttributeError,) + RECOVERABLE_ERRORS as e:
+            LOGGER.warning(f"Stream ended early after {yielded} parts: {e}")
         finally:
-            LOGGER.debug("Finished yielding file with {current_part} parts.")
-            work_loads[index] -= 1
+            if served and key and last + 1 < file_id.file_size:
+                cursor.read_ahead.extend_to(min(file_id.file_size, last + 1 + cursor.read_ahead.max_depth * PART_SIZE) - 1)
+                stream_cursors.park(key, cursor)
+            else:
+                cursor.close()
+            LOGGER.debug(f"Finished yielding file with {yielded} parts.")
 
-    async def generate_media_session(self, client: Client, file_id: FileId) -> Session:
-        media_session = client.media_sessions.get(file_id.dc_id, None)
-        if media_session is None:
-            if file_id.dc_id != await client.storage.dc_id():
-                media_session = Session(
-                    client,
-                    file_id.dc_id,
-                    await Auth(client, file_id.dc_id, await client.storage.test_mode()).create(),
-                    await client.storage.test_mode(),
-                    is_media=True,
+    async def get_part(self, file_id: FileId, media_session: Session, location, offset: int, limit: int) -> bytes:
+        # Only whole parts are cached. While a cache would keep it, a smaller
+        # part is cut out of the whole part around it, so head and tail
+        # probes and the first parts after a seek are cached too; otherwise
+        # it is cut from a running whole part or fetched on its own.
+        base = offset - offset % PART_SIZE
+        pinned = segment_cache.covers(file_id.file_size, base)
+        chunk = segment_cache.get(file_id.media_id, base) if pinned else None
+        if chunk is None:
+            chunk = await chunk_cache.get(file_id.media_id, base)
+        if chunk is None and limit < PART_SIZE:
+            chunk = await part_flights.join((file_id.media_id, base, PART_SIZE))
+        if chunk is None:
+            if limit < PART_SIZE and not pinned and not chunk_cache.enabled:
+                return await part_flights.do(
+                    (file_id.media_id, offset, limit),
+                    lambda: self.load_part(file_id, media_session, location, offset, limit)
                 )
-                await media_session.start()
-                for _ in range(6):
-                    exported_auth = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=file_id.dc_id))
-                    try:
-                        
-                        await media_session.send(raw.functions.auth.ImportAuthorization(id=exported_auth.id, bytes=exported_auth.bytes))
-                        break
-                    except AuthBytesInvalid:
-                        LOGGER.debug(f"Invalid authorization bytes for DC {file_id.dc_id}, retrying...")
-                    except OSError:
-                        LOGGER.debug(f"Connection error, retrying...")
-                        await asyncio.sleep(2)
-                else:
-                    await media_session.stop()
-                    LOGGER.debug(f"Failed to establish media session for DC {file_id.dc_id} after multiple retries")
-                    return None 
+            chunk = await part_flights.do(
+                (file_id.media_id, base, PART_SIZE),
+                lambda: self.load_part(file_id, media_session, location, base, PART_SIZE)
+            )
+            if pinned:
+                segment_cache.put(file_id.media_id, base, chunk)
+        return chunk if limit == PART_SIZE else chunk[offset - base:offset - base + limit]
+
+    async def load_part(self, file_id: FileId, media_session: Session, location, offset: int, limit: int) -> bytes:
+        chunk = await self.fetch_part(media_session, location, offset, limit)
+        if limit == PART_SIZE:
+            chunk_cache.put_later(file_id.media_id, offset, chunk)
+        return chunk
+
+    async def pin_segments(self, chat_id: int, message_id: int) -> None:
+        file_id = await self.get_file_properties(chat_id, message_id)
+        offsets = [
+            offset for offset in segment_cache.offsets(file_id.file_size)
+            if not segment_cache.has(file_id.media_id, offset)
+        ]
+        if not offsets:
+            return
+        media_session = await self.generate_media_session(self.client, file_id)
+        location = await self.get_location(file_id)
+        await asyncio.gather(*(
+            self.get_part(file_id, media_session, location, offset, PART_SIZE) for offset in offsets
+        ))
+        LOGGER.debug(f"Pinned {len(offsets)} head/tail parts of message {message_id}")
+
+    async def fetch_part(self, media_session: Session, location, offset: int, limit: int) -> bytes:
+        started = monotonic()
+        media_id = getattr(location, "id", None)
+        try:
+            cdn_file = self.cdn_files.get(media_id)
+            if cdn_file:
+                chunk = await self.fetch_cdn_part(cdn_file, media_session, location, offset, limit)
             else:
-                media_session = Session(
-                    client,
-                    file_id.dc_id,
-                    await client.storage.auth_key(),
-                    await client.storage.test_mode(),
-                    is_media=True,
-                )
-                await media_session.start()
-            LOGGER.debug(f"Created media session for DC {file_id.dc_id}")
-            client.media_sessions[file_id.dc_id] = media_session
-        else:
-            LOGGER.debug(f"Using cached media session for DC {file_id.dc_id}")
-        return media_session
+                r = await media_session.send(raw.functions.upload.GetFile(
+                    location=location, offset=offset, limit=limit,
+                    cdn_supported=Telegram.CDN_SUPPORT and media_id not in self.cdn_blocked
+                ))
+                if isinstance(r, raw.types.upload.FileCdnRedirect):
+                    cdn_file = self.cdn_files[media_id] = CdnFile(r)
+                    while len(self.cdn_files) > MAX_CDN_FILES:
+                        self.cdn_files.popitem(last=False)
+                    LOGGER.debug(f"File {media_id} redirected to CDN DC {r.dc_id}")
+                    chunk = await self.fetch_cdn_part(cdn_file, media_session, location, offset, limit)
+                elif isinstance(r, raw.types.upload.File):
+                    chunk = r.bytes
+                else:
+                    return b""
+        except FloodWait as e:
+            scheduler.record_flood_wait(self.index, e.value)
+            flood_waits.inc(str(self.index))
+            raise
+        except Exception as e:
+            # Only transport faults count against the client's health; stale
+            # file references and server-side errors say nothing about it.
+            if isinstance(e, OSError):
+                scheduler.record_error(self.index)
+            getfile_errors.inc(str(self.index))
+            raise
+        elapsed = monotonic() - started
+        scheduler.record_transfer(self.index, media_session.dc_id, len(chunk), elapsed)
+        getfile_seconds.observe(elapsed, str(media_session.dc_id), str(self.index))
+        return chunk
+
+    async def fetch_cdn_part(self, cdn_file: CdnFile, media_session: Session, location, offset: int, limit: int) -> bytes:
+        try:
+            cdn_session = await session_pool.acquire(self.index, self.client, cdn_file.dc_id, cdn=True)
+            if cdn_session is None:
+                raise ConnectionError(f"no session to CDN DC {cdn_file.dc_id}")
+            return await cdn_file.fetch(media_session, cdn_session, offset, limit)
+        except Exception as e:
+            # Anything wrong on the CDN side, from reaching the CDN DC to a
+            # bad hash, sends the file back to its own DC for good; the
+            # master DC always has it.
+            LOGGER.warning(f"CDN fetch of {location.id} failed, falling back to DC {media_session.dc_id}: {e}")
+            self.cdn_files.pop(location.id, None)
+            self.cdn_blocked.add(location.id)
+            r = await media_session.send(raw.functions.upload.GetFile(location=location, offset=offset, limit=limit))
+            return r.bytes if isinstance(r, raw.types.upload.File) else b""
 
+    async def generate_media_session(self, client: Client, file_id: FileId) -> Session:
+        return await session_pool.acquire(self.index, client, file_id.dc_id)
 
     @staticmethod
     async def get_location(file_id: FileId) -> Union[raw.types.InputPhotoFileLocation, raw.types.InputDocumentFileLocation, raw.types.InputPeerPhotoFileLocation]:
@@ -139,8 +695,32 @@ class ByteStreamer:
                                                            thumb_size=file_id.thumbnail_size)
         return location
 
-    async def clean_cache(self) -> None:
-        while True:
-            await asyncio.sleep(self.clean_timer)
-            self.__cached_file_ids.clear()
-            LOGGER.debug("Cleaned the cache")
+
+class_cache: Dict[int, ByteStreamer] = {}
+
+
+def get_streamer(index: int) -> ByteStreamer:
+    tg_connect = class_cache.get(index)
+    if not tg_connect:
+        tg_connect = ByteStreamer(multi_clients[index], index)
+        class_cache[index] = tg_connect
+    return tg_connect
+
+
+def pick_stripe(index: int, dc_id: Optional[int] = None) -> List[int]:
+    if Telegram.STRIPE_CLIENTS <= 1:
+        return []
+    return [
+        i for i in scheduler.pick_many(Telegram.STRIPE_CLIENTS - 1, dc_id, exclude=[index])
+        if scheduler.available(i)
+    ]
+
+
+async def pin_file_segments(chat_id: int, message_id: int) -> None:
+    if not segment_cache.enabled:
+        return
+    index = scheduler.pick()
+    try:
+        await get_streamer(index).pin_segments(chat_id, message_id)
+    except Exception as e:
+        LOGGER.error(f"Failed to pin head/tail segments of message {message_id}: {e}")
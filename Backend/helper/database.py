@@ -1,17 +1,33 @@
-from asyncio import create_task
+import heapq
+from asyncio import create_task, gather, sleep
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bson import json_util
 from bson import ObjectId
 import motor.motor_asyncio
 from datetime import datetime
+from itertools import islice
 from pydantic import ValidationError
-from pymongo import ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
 from typing import Dict, List, Optional, Tuple, Any
 
 from Backend.logger import LOGGER
 from Backend.config import Telegram
 import re
-from Backend.helper.encrypt import decode_string, encode_string
+from Backend.helper.encrypt import decode_many, encode_string
 from Backend.helper.modal import Episode, MovieSchema, QualityDetail, Season, TVShowSchema
-from Backend.helper.task_manager import delete_message
+from Backend.helper.shard_executor import shard_executor
+from Backend.helper.task_manager import delete_messages
+
+
+# Counter key for all documents of a collection; every other key is a genre.
+ALL_KEY = "*"
+# Times a shard's counters are recounted when concurrent updates keep
+# changing them mid-reconcile.
+RECONCILE_ATTEMPTS = 3
+# Deepest offset a page number may reach. Finding its start key reads that
+# many keys from every shard; deeper pages follow next_cursor.
+MAX_PAGE_OFFSET = 1000
 
 
 def convert_objectid_to_str(document: Dict[str, Any]) -> Dict[str, Any]:
@@ -25,6 +41,27 @@ def convert_objectid_to_str(document: Dict[str, Any]) -> Dict[str, Any]:
     return document
 
 
+def sort_key(value: Any, _id: Any) -> tuple:
+    # Python ordering of a (sort value, _id) pair matching MongoDB's, where
+    # missing and null values sort lowest.
+    return (value is not None, value if value is not None else 0, _id)
+
+
+def encode_page_cursor(sort_field: str, direction: int, genre_filter: Optional[str], document: Dict[str, Any]) -> str:
+    state = {"f": sort_field, "d": direction, "g": genre_filter, "v": document.get(sort_field), "id": document["_id"]}
+    return urlsafe_b64encode(json_util.dumps(state).encode()).rstrip(b"=").decode()
+
+
+def decode_page_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        state = json_util.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"invalid page cursor: {e}") from None
+    if not isinstance(state, dict):
+        raise ValueError("invalid page cursor")
+    return state
+
+
 class Database:
     def __init__(self, db_name: str = "dbFyvio"):
         self.db_uris = Telegram.DATABASE
@@ -37,6 +74,7 @@ class Database:
         self.dbs: Dict[str, motor.motor_asyncio.AsyncIOMotorDatabase] = {}
 
         self.current_db_index = 1
+        self.counters_ready = False
 
     async def connect(self):
         try:
@@ -60,6 +98,7 @@ class Database:
                 self.current_db_index = state["current_index"]
 
             LOGGER.info(f"Active storage DB: storage_{self.current_db_index}")
+            self.counters_ready = bool(await self.dbs["tracking"]["state"].find_one({"_id": "counters"}))
 
         except Exception as e:
             LOGGER.error(f"Database connection error: {e}")
@@ -92,57 +131,97 @@ class Database:
         sort_dict: Dict[str, int],
         page: int,
         page_size: int,
-        filter_dict: Optional[dict] = None
+        genre_filter: Optional[str] = None,
+        cursor: Optional[str] = None
     ):
-        filter_dict = filter_dict or {}
-        skip = (page - 1) * page_size
-        results = []
-        dbs_checked = []
-        total_count = 0
-
-        db_counts = []
-        for i in range(1, self.current_db_index + 1):
-            db_key = f"storage_{i}"
-            db = self.dbs[db_key]
-            count = await db[collection_name].count_documents(filter_dict)
-            db_counts.append((i, count))
-            total_count += count
-
-        start_db_index = None
-        for db_index, count in reversed(db_counts):
-            if skip < count:
-                start_db_index = db_index
-                break
-            skip -= count
-
-        if not start_db_index:
-            return [], [], total_count
-
-        for db_index, count in reversed(db_counts):
-            if db_index < start_db_index:
-                continue
+        # Pages are merged from all shards in one global order (sort field,
+        # then _id). A cursor continues right after the key it carries;
+        # page numbers find their start key from a merge of keys only.
+        sort_field, direction = next(iter(sort_dict.items()))
+        sort = [(sort_field, direction), ("_id", direction)]
+        filter_dict = {"genres": {"$in": [genre_filter]}} if genre_filter else {}
 
-            db_key = f"storage_{db_index}"
-            db = self.dbs[db_key]
-            dbs_checked.append(db_index)
+        db_counts = await self._shard_counts(collection_name, genre_filter or ALL_KEY)
+        total_count = sum(count for _, count in db_counts)
 
-            cursor = (
-                db[collection_name]
-                .find(filter_dict)
-                .sort(sort_dict)
-                .skip(skip if db_index == start_db_index else 0)
-                .limit(page_size - len(results))
+        after = None
+        if cursor:
+            state = decode_page_cursor(cursor)
+            if (state.get("f"), state.get("d"), state.get("g")) != (sort_field, direction, genre_filter) or "id" not in state:
+                raise ValueError("page cursor does not belong to this listing")
+            after = (state.get("v"), state["id"])
+        elif page > 1:
+            skip = (page - 1) * page_size
+            if skip >= total_count:
+                return [], [], total_count, None
+            if skip > MAX_PAGE_OFFSET:
+                raise ValueError(f"page {page} is past the first {MAX_PAGE_OFFSET} items; follow next_cursor instead")
+            keys = await self._merge_shards(collection_name, filter_dict, sort, skip, projection={sort_field: 1})
+            if len(keys) < skip:
+                return [], [], total_count, None
+            last, _ = keys[skip - 1]
+            after = (last.get(sort_field), last["_id"])
+
+        query = filter_dict if after is None else {**filter_dict, **self._after_key(sort_field, direction, *after)}
+        merged = await self._merge_shards(collection_name, query, sort, page_size + 1)
+        page_docs = merged[:page_size]
+        next_cursor = None
+        if len(merged) > page_size:
+            next_cursor = encode_page_cursor(sort_field, direction, genre_filter, page_docs[-1][0])
+
+        dbs_checked = sorted({db_index for _, db_index in page_docs})
+        return [doc for doc, _ in page_docs], dbs_checked, total_count, next_cursor
+
+    async def _merge_shards(
+        self, collection_name: str, query: dict, sort: List[Tuple[str, int]], limit: int, projection: Optional[dict] = None
+    ) -> List[Tuple[dict, int]]:
+        async def fetch(db_index: int) -> List[Tuple[dict, int]]:
+            docs = await (
+                self.dbs[f"storage_{db_index}"][collection_name]
+                .find(query, projection)
+                .sort(sort)
+                .limit(limit)
+                .to_list(None)
             )
-
-            docs = await cursor.to_list(None)
-            results.extend(docs)
-
-            if len(results) >= page_size:
-                break
-
-        return results, dbs_checked, total_count
-
-
+            return [(doc, db_index) for doc in docs]
+
+        shards = await shard_executor.gather(f"list_{collection_name}", range(1, self.current_db_index + 1), fetch)
+        sort_field, direction = sort[0]
+        merged = heapq.merge(
+            *shards.values(),
+            key=lambda item: sort_key(item[0].get(sort_field), item[0]["_id"]),
+            reverse=direction == DESCENDING
+        )
+        return list(islice(merged, limit))
+
+    def _after_key(self, sort_field: str, direction: int, value: Any, last_id: Any) -> dict:
+        # Documents after (value, last_id) in sort order. Missing and null
+        # values sort first ascending and last descending, and $gt/$lt
+        # never match them, so they are handled separately.
+        op = "$gt" if direction == ASCENDING else "$lt"
+        tie = {sort_field: value, "_id": {op: last_id}}
+        if value is None:
+            return {"$or": [tie, {sort_field: {"$ne": None}}]} if direction == ASCENDING else tie
+        after = [{sort_field: {op: value}}, tie]
+        if direction == DESCENDING:
+            after.append({sort_field: None})
+        return {"$or": after}
+
+    async def _find_existing(
+        self, collection_name: str, db_index: int, imdb_id, tmdb_id, title, release_year
+    ) -> Optional[dict]:
+        collection = self.dbs[f"storage_{db_index}"][collection_name]
+        document = None
+        if imdb_id:
+            document = await collection.find_one({"imdb_id": imdb_id})
+        if not document and tmdb_id:
+            document = await collection.find_one({"tmdb_id": tmdb_id})
+        if not document and title and release_year:
+            document = await collection.find_one({
+                "title": title,
+                "release_year": release_year
+            })
+        return document
 
     async def _move_document(
         self, collection_name: str, document: dict, old_db_index: int
@@ -153,6 +232,8 @@ class Database:
         try:
             await self.dbs[current_db_key][collection_name].insert_one(document)
             await self.dbs[old_db_key][collection_name].delete_one({"_id": document["_id"]})
+            await self._adjust_counts(collection_name, old_db_index, self._count_deltas(document, -1))
+            await self._adjust_counts(collection_name, self.current_db_index, self._count_deltas(document, 1))
             LOGGER.info(f"✅ Moved document {document.get('tmdb_id')} from {old_db_key} to {current_db_key}")
             return True
         except Exception as e:
@@ -260,31 +341,21 @@ class Database:
         existing_db_key = None
         existing_db_index = None
 
-        for db_index in range(1, total_storage_dbs + 1):
-            db_key = f"storage_{db_index}"
-            movie = None
-
-            if imdb_id:
-                movie = await self.dbs[db_key]["movie"].find_one({"imdb_id": imdb_id})
-            if not movie and tmdb_id:
-                movie = await self.dbs[db_key]["movie"].find_one({"tmdb_id": tmdb_id})
-            if not movie and title and release_year:
-                movie = await self.dbs[db_key]["movie"].find_one({
-                    "title": title,
-                    "release_year": release_year
-                })
-
-            if movie:
-                existing_movie = movie
-                existing_db_key = db_key
-                existing_db_index = db_index
-                break
+        found = await shard_executor.first(
+            "find_movie", range(1, total_storage_dbs + 1),
+            lambda db_index: self._find_existing("movie", db_index, imdb_id, tmdb_id, title, release_year),
+            strict=True
+        )
+        if found:
+            existing_db_index, existing_movie = found
+            existing_db_key = f"storage_{existing_db_index}"
 
         # ---------------- INSERT NEW MOVIE ----------------
         if not existing_movie:
             try:
                 movie_dict["db_index"] = self.current_db_index
                 result = await self.dbs[current_db_key]["movie"].insert_one(movie_dict)
+                await self._adjust_counts("movie", self.current_db_index, self._count_deltas(movie_dict, 1))
                 return result.inserted_id
             except Exception as e:
                 LOGGER.error(f"Insertion failed in {current_db_key}: {e}")
@@ -299,17 +370,7 @@ class Database:
         if Telegram.REPLACE_MODE:
             # delete all same-quality entries
             to_delete = [q for q in existing_qualities if q.get("quality") == target_quality]
-
-            for q in to_delete:
-                try:
-                    old_id = q.get("id")
-                    if old_id:
-                        decoded = await decode_string(old_id)
-                        chat_id = int(f"-100{decoded['chat_id']}")
-                        msg_id = int(decoded['msg_id'])
-                        create_task(delete_message(chat_id, msg_id))
-                except Exception as e:
-                    LOGGER.error(f"Failed to delete old quality: {e}")
+            self._delete_files(q.get("id") for q in to_delete)
 
             existing_qualities = [
                 q for q in existing_qualities if q.get("quality") != target_quality
@@ -359,31 +420,21 @@ class Database:
         existing_db_key = None
         existing_db_index = None
 
-        for db_index in range(1, total_storage_dbs + 1):
-            db_key = f"storage_{db_index}"
-            tv = None
-
-            if imdb_id:
-                tv = await self.dbs[db_key]["tv"].find_one({"imdb_id": imdb_id})
-            if not tv and tmdb_id:
-                tv = await self.dbs[db_key]["tv"].find_one({"tmdb_id": tmdb_id})
-            if not tv and title and release_year:
-                tv = await self.dbs[db_key]["tv"].find_one({
-                    "title": title,
-                    "release_year": release_year
-                })
-
-            if tv:
-                existing_tv = tv
-                existing_db_key = db_key
-                existing_db_index = db_index
-                break
+        found = await shard_executor.first(
+            "find_tv", range(1, total_storage_dbs + 1),
+            lambda db_index: self._find_existing("tv", db_index, imdb_id, tmdb_id, title, release_year),
+            strict=True
+        )
+        if found:
+            existing_db_index, existing_tv = found
+            existing_db_key = f"storage_{existing_db_index}"
 
         # ---------------- INSERT NEW TV ----------------
         if not existing_tv:
             try:
                 tv_show_dict["db_index"] = self.current_db_index
                 result = await self.dbs[current_db_key]["tv"].insert_one(tv_show_dict)
+                await self._adjust_counts("tv", self.current_db_index, self._count_deltas(tv_show_dict, 1))
                 return result.inserted_id
             except Exception as e:
                 LOGGER.error(f"Insertion failed in {current_db_key}: {e}")
@@ -393,6 +444,7 @@ class Database:
 
         # ---------------- UPDATE TV ----------------
         tv_id = existing_tv["_id"]
+        replaced_ids = []
 
         for season in tv_show_dict["seasons"]:
             existing_season = next(
@@ -427,16 +479,7 @@ class Database:
                             if q.get("quality") == target_quality
                         ]
 
-                        for q in to_delete:
-                            try:
-                                old_id = q.get("id")
-                                if old_id:
-                                    decoded = await decode_string(old_id)
-                                    chat_id = int(f"-100{decoded['chat_id']}")
-                                    msg_id = int(decoded['msg_id'])
-                                    create_task(delete_message(chat_id, msg_id))
-                            except Exception as e:
-                                LOGGER.error(f"Failed to delete old quality: {e}")
+                        replaced_ids += [q.get("id") for q in to_delete]
 
                         existing_episode["telegram"] = [
                             q for q in existing_episode["telegram"]
@@ -447,6 +490,7 @@ class Database:
                     else:
                         existing_episode["telegram"].append(quality)
 
+        self._delete_files(replaced_ids)
         existing_tv["updated_on"] = datetime.utcnow()
 
         # ---------------- MOVE DB IF NEEDED ----------------
@@ -468,11 +512,10 @@ class Database:
             if any(keyword in str(e).lower() for keyword in ["storage", "quota"]):
                 return await self._handle_storage_error(self.update_tv_show, tv_show_data, total_storage_dbs=total_storage_dbs)
     
-    async def sort_movies(self, sort_params, page, page_size, genre_filter=None):
+    async def sort_movies(self, sort_params, page, page_size, genre_filter=None, cursor=None):
         sort_dict = self._get_sort_dict(sort_params)
-        filter_dict = {"genres": {"$in": [genre_filter]}} if genre_filter else {}
-        results, dbs_checked, total_count = await self._paginate_collection(
-            "movie", sort_dict, page, page_size, filter_dict=filter_dict
+        results, dbs_checked, total_count, next_cursor = await self._paginate_collection(
+            "movie", sort_dict, page, page_size, genre_filter=genre_filter, cursor=cursor
         )
         total_pages = (total_count + page_size - 1) // page_size
         return {
@@ -480,14 +523,14 @@ class Database:
             "total_pages": total_pages,
             "databases_checked": dbs_checked,
             "current_page": page,
+            "next_cursor": next_cursor,
             "movies": [convert_objectid_to_str(result) for result in results],
         }
 
-    async def sort_tv_shows(self, sort_params, page, page_size, genre_filter=None):
+    async def sort_tv_shows(self, sort_params, page, page_size, genre_filter=None, cursor=None):
         sort_dict = self._get_sort_dict(sort_params)
-        filter_dict = {"genres": {"$in": [genre_filter]}} if genre_filter else {}
-        results, dbs_checked, total_count = await self._paginate_collection(
-            "tv", sort_dict, page, page_size, filter_dict=filter_dict
+        results, dbs_checked, total_count, next_cursor = await self._paginate_collection(
+            "tv", sort_dict, page, page_size, genre_filter=genre_filter, cursor=cursor
         )
         total_pages = (total_count + page_size - 1) // page_size
         return {
@@ -495,6 +538,7 @@ class Database:
             "total_pages": total_pages,
             "databases_checked": dbs_checked,
             "current_page": page,
+            "next_cursor": next_cursor,
             "tv_shows": [convert_objectid_to_str(result) for result in results],
         }
 
@@ -539,48 +583,22 @@ class Database:
                 }}
             ]
             
-            results = []
-            dbs_checked = []
-            
-            active_db_key = f"storage_{self.current_db_index}"
-            active_db = self.dbs[active_db_key]
-            dbs_checked.append(self.current_db_index)
-            
-            tv_results = await active_db["tv"].aggregate(tv_pipeline).to_list(None)
-            movie_results = await active_db["movie"].aggregate(movie_pipeline).to_list(None)
-            combined = tv_results + movie_results
-            results.extend(combined)
-            
-            if len(results) < page_size:
-                previous_db_index = self.current_db_index - 1
-                while previous_db_index > 0 and len(results) < page_size:
-                    prev_db_key = f"storage_{previous_db_index}"
-                    prev_db = self.dbs[prev_db_key]
-                    tv_results_prev = await prev_db["tv"].aggregate(tv_pipeline).to_list(None)
-                    movie_results_prev = await prev_db["movie"].aggregate(movie_pipeline).to_list(None)
-                    combined_prev = tv_results_prev + movie_results_prev
-                    results.extend(combined_prev)
-                    dbs_checked.append(previous_db_index)
-                    previous_db_index -= 1
-
-            total_count = 0
-            for db_index in dbs_checked:
-                key = f"storage_{db_index}"
-                db = self.dbs[key]
-                tv_count = await db["tv"].count_documents({
-                    "$or": [
-                        {"title": regex_query},
-                        {"seasons.episodes.telegram.name": regex_query}
-                    ]
-                })
-                movie_count = await db["movie"].count_documents({
-                    "$or": [
-                        {"title": regex_query},
-                        {"telegram.name": regex_query}
-                    ]
-                })
-                total_count += (tv_count + movie_count)
-            
+            async def search_shard(db_index: int):
+                db = self.dbs[f"storage_{db_index}"]
+                tv_results, movie_results = await gather(
+                    db["tv"].aggregate(tv_pipeline).to_list(None),
+                    db["movie"].aggregate(movie_pipeline).to_list(None)
+                )
+                return tv_results + movie_results
+
+            # Newest shard first, as before; every shard is searched at once
+            # and the total counts all of them.
+            shard_results = await shard_executor.gather(
+                "search", range(self.current_db_index, 0, -1), search_shard
+            )
+            results = [doc for docs in shard_results.values() for doc in docs]
+            total_count = len(results)
+
             paged_results = results[skip:skip + page_size]
 
             return {
@@ -647,6 +665,13 @@ class Database:
     # -------------------------------
 
 
+    async def find_media_details(self, tmdb_id: int) -> Optional[dict]:
+        found = await shard_executor.first(
+            "media_details", range(1, self.current_db_index + 1),
+            lambda db_index: self.get_media_details(tmdb_id, db_index)
+        )
+        return found[1] if found else None
+
     async def get_document(self, media_type: str, tmdb_id: int, db_index: int) -> Optional[Dict[str, Any]]:
         db_key = f"storage_{db_index}"
         if media_type.lower() in ["tv", "series"]:
@@ -668,7 +693,13 @@ class Database:
         collection = self.dbs[db_key][collection_name]
 
         try:
+            old_genres = None
+            if "genres" in update_data:
+                old_doc = await collection.find_one({"tmdb_id": int(tmdb_id)}, {"genres": 1})
+                old_genres = (old_doc or {}).get("genres")
             result = await collection.update_one({"tmdb_id": int(tmdb_id)}, {"$set": update_data})
+            if result.modified_count and "genres" in update_data:
+                await self.count_genre_change(collection_name, int(db_index), old_genres, update_data["genres"])
 
             return result.modified_count > 0
 
@@ -692,6 +723,7 @@ class Database:
                         LOGGER.error(f"Document with tmdb_id {tmdb_id} not found in {db_key} during migration.")
                         return False
 
+                    old_deltas = self._count_deltas(old_doc, -1)
                     old_doc.update(update_data)
                     old_doc["db_index"] = next_db_index
                     old_doc.pop("_id", None)
@@ -699,6 +731,8 @@ class Database:
                     LOGGER.info(f"Inserted document {insert_result.inserted_id} into {new_db_key}")
                     await self.dbs[db_key][collection_name].delete_one({"tmdb_id": int(tmdb_id)})
                     LOGGER.info(f"Deleted document tmdb_id {tmdb_id} from {db_key}")
+                    await self._adjust_counts(collection_name, db_index_int, old_deltas)
+                    await self._adjust_counts(collection_name, next_db_index, self._count_deltas(old_doc, 1))
                     self.current_db_index = next_db_index
                     await self.update_current_db_index()
                     LOGGER.info(f"Switched to {new_db_key} and document migrated successfully.")
@@ -715,37 +749,23 @@ class Database:
         if media_type == "Movie":
             doc = await self.dbs[db_key]["movie"].find_one({"tmdb_id": tmdb_id})
             if doc and "telegram" in doc:
-                for quality in doc["telegram"]:
-                    try:
-                        old_id = quality.get("id")
-                        if old_id:
-                            decoded_data = await decode_string(old_id)
-                            chat_id = int(f"-100{decoded_data['chat_id']}")
-                            msg_id = int(decoded_data['msg_id'])
-                            create_task(delete_message(chat_id, msg_id))
-                    except Exception as e:
-                        LOGGER.error(f"Failed to queue file for deletion: {e}")
+                self._delete_files(quality.get("id") for quality in doc["telegram"])
             
             result = await self.dbs[db_key]["movie"].delete_one({"tmdb_id": tmdb_id})
         else:
             doc = await self.dbs[db_key]["tv"].find_one({"tmdb_id": tmdb_id})
             if doc and "seasons" in doc:
-                for season in doc["seasons"]:
-                    for episode in season.get("episodes", []):
-                        for quality in episode.get("telegram", []):
-                            try:
-                                old_id = quality.get("id")
-                                if old_id:
-                                    decoded_data = await decode_string(old_id)
-                                    chat_id = int(f"-100{decoded_data['chat_id']}")
-                                    msg_id = int(decoded_data['msg_id'])
-                                    create_task(delete_message(chat_id, msg_id))
-                            except Exception as e:
-                                LOGGER.error(f"Failed to queue file for deletion: {e}")
+                self._delete_files(
+                    quality.get("id")
+                    for season in doc["seasons"]
+                    for episode in season.get("episodes", [])
+                    for quality in episode.get("telegram", [])
+                )
             
             result = await self.dbs[db_key]["tv"].delete_one({"tmdb_id": tmdb_id})
         
         if result.deleted_count > 0:
+            await self._adjust_counts("movie" if media_type == "Movie" else "tv", int(db_index), self._count_deltas(doc, -1))
             LOGGER.info(f"{media_type} with tmdb_id {tmdb_id} deleted successfully.")
             return True
         LOGGER.info(f"No document found with tmdb_id {tmdb_id}.")
@@ -760,15 +780,7 @@ class Database:
 
         for q in movie["telegram"]:
             if q.get("id") == id:
-                try:
-                    old_id = q.get("id")
-                    if old_id:
-                        decoded_data = await decode_string(old_id)
-                        chat_id = int(f"-100{decoded_data['chat_id']}")
-                        msg_id = int(decoded_data['msg_id'])
-                        create_task(delete_message(chat_id, msg_id))
-                except Exception as e:
-                    LOGGER.error(f"Failed to queue file for deletion: {e}")
+                self._delete_files([id])
                 break
         
         original_len = len(movie["telegram"])
@@ -793,16 +805,7 @@ class Database:
             if season.get("season_number") == season_number:
                 for ep in season["episodes"]:
                     if ep.get("episode_number") == episode_number:
-                        for quality in ep.get("telegram", []):
-                            try:
-                                old_id = quality.get("id")
-                                if old_id:
-                                    decoded_data = await decode_string(old_id)
-                                    chat_id = int(f"-100{decoded_data['chat_id']}")
-                                    msg_id = int(decoded_data['msg_id'])
-                                    create_task(delete_message(chat_id, msg_id))
-                            except Exception as e:
-                                LOGGER.error(f"Failed to queue file for deletion: {e}")
+                        self._delete_files(quality.get("id") for quality in ep.get("telegram", []))
                         break
                 
                 original_len = len(season["episodes"])
@@ -826,17 +829,11 @@ class Database:
         
         for season in tv["seasons"]:
             if season.get("season_number") == season_number:
-                for episode in season.get("episodes", []):
-                    for quality in episode.get("telegram", []):
-                        try:
-                            old_id = quality.get("id")
-                            if old_id:
-                                decoded_data = await decode_string(old_id)
-                                chat_id = int(f"-100{decoded_data['chat_id']}")
-                                msg_id = int(decoded_data['msg_id'])
-                                create_task(delete_message(chat_id, msg_id))
-                        except Exception as e:
-                            LOGGER.error(f"Failed to queue file for deletion: {e}")
+                self._delete_files(
+                    quality.get("id")
+                    for episode in season.get("episodes", [])
+                    for quality in episode.get("telegram", [])
+                )
                 break
         
         original_len = len(tv["seasons"])
@@ -863,15 +860,7 @@ class Database:
                     if episode.get("episode_number") == episode_number and "telegram" in episode:
                         for q in episode["telegram"]:
                             if q.get("id") == id:
-                                try:
-                                    old_id = q.get("id")
-                                    if old_id:
-                                        decoded_data = await decode_string(old_id)
-                                        chat_id = int(f"-100{decoded_data['chat_id']}")
-                                        msg_id = int(decoded_data['msg_id'])
-                                        create_task(delete_message(chat_id, msg_id))
-                                except Exception as e:
-                                    LOGGER.error(f"Failed to queue file for deletion: {e}")
+                                self._delete_files([id])
                                 break
                         
                         original_len = len(episode["telegram"])
@@ -886,20 +875,235 @@ class Database:
         return result.modified_count > 0
 
 
+    # -------------------------------
+    # Catalog Counters
+    # -------------------------------
+    # Document counts per (collection, shard, key) live in the tracking DB
+    # so catalog pages do not count every shard on every request. Writes
+    # adjust them after the storage write succeeds; the storage and
+    # tracking DBs are separate clusters, so this cannot be one
+    # transaction, and reconcile_counters recounts periodically to repair
+    # any drift.
+
+    def _count_deltas(self, document: Optional[dict], delta: int) -> Dict[str, int]:
+        genres = (document or {}).get("genres") or []
+        return {ALL_KEY: delta, **{genre: delta for genre in set(genres) if isinstance(genre, str)}}
+
+    async def _adjust_counts(self, collection_name: str, db_index: int, deltas: Dict[str, int]) -> None:
+        ops = [
+            UpdateOne(
+                {"_id": f"{collection_name}:{db_index}:{key}"},
+                {"$inc": {"count": delta}, "$setOnInsert": {"collection": collection_name, "db_index": db_index, "key": key}},
+                upsert=True
+            )
+            for key, delta in deltas.items() if delta
+        ]
+        if not ops:
+            return
+        try:
+            await self.dbs["tracking"]["counters"].bulk_write(ops, ordered=False)
+        except Exception as e:
+            LOGGER.error(f"Failed to update {collection_name} counters of storage_{db_index}: {e}")
+
+    async def count_genre_change(self, collection_name: str, db_index: int, old_genres, new_genres) -> None:
+        old, new = set(old_genres or []), set(new_genres or [])
+        deltas = {genre: -1 for genre in old - new}
+        deltas.update({genre: 1 for genre in new - old})
+        await self._adjust_counts(collection_name, db_index, deltas)
+
+    async def _shard_counts(self, collection_name: str, key: str) -> List[Tuple[int, int]]:
+        db_indexes = range(1, self.current_db_index + 1)
+        if self.counters_ready:
+            try:
+                docs = await self.dbs["tracking"]["counters"].find({"collection": collection_name, "key": key}).to_list(None)
+                stored = {doc["db_index"]: doc["count"] for doc in docs}
+                return [(i, max(0, stored.get(i, 0))) for i in db_indexes]
+            except Exception as e:
+                LOGGER.error(f"Failed to read {collection_name} counters, counting instead: {e}")
+        filter_dict = {} if key == ALL_KEY else {"genres": {"$in": [key]}}
+        counts = await shard_executor.gather(
+            f"count_{collection_name}", db_indexes,
+            lambda i: self.dbs[f"storage_{i}"][collection_name].count_documents(filter_dict)
+        )
+        return list(counts.items())
+
+    async def _reconcile_collection(self, collection_name: str, db_index: int) -> bool:
+        # Compare-and-set: counters are read before counting and only written
+        # back where they still hold that value. Returns False when an $inc
+        # landed in between, leaving that counter for a retry.
+        counters = self.dbs["tracking"]["counters"]
+        collection = self.dbs[f"storage_{db_index}"][collection_name]
+        stored = {
+            doc["key"]: doc["count"]
+            async for doc in counters.find({"collection": collection_name, "db_index": db_index})
+        }
+        counts = {ALL_KEY: await collection.count_documents({})}
+        async for row in collection.aggregate([
+            {"$project": {"genres": {"$setUnion": [{"$ifNull": ["$genres", []]}, []]}}},
+            {"$unwind": "$genres"},
+            {"$group": {"_id": "$genres", "count": {"$sum": 1}}}
+        ]):
+            if isinstance(row["_id"], str):
+                counts[row["_id"]] = row["count"]
+
+        drifted = [key for key in counts.keys() | stored.keys() if counts.get(key, 0) != stored.get(key, 0)]
+        if not drifted:
+            return True
+        if self.counters_ready:
+            LOGGER.warning(f"Correcting {len(drifted)} drifted {collection_name} counters in storage_{db_index}")
+        try:
+            result = await counters.bulk_write([
+                UpdateOne(
+                    {
+                        "_id": f"{collection_name}:{db_index}:{key}",
+                        "count": stored[key] if key in stored else {"$exists": False}
+                    },
+                    {"$set": {"count": counts.get(key, 0), "collection": collection_name, "db_index": db_index, "key": key}},
+                    upsert=True
+                )
+                for key in drifted
+            ], ordered=False)
+        except BulkWriteError:
+            # An upsert hit a counter created by a concurrent $inc.
+            return False
+        return result.matched_count + result.upserted_count == len(drifted)
+
+    async def reconcile_counters(self) -> None:
+        total_storage_dbs = len(self.dbs) - 1
+        for db_index in range(1, total_storage_dbs + 1):
+            for collection_name in ("movie", "tv"):
+                for _ in range(RECONCILE_ATTEMPTS):
+                    if await self._reconcile_collection(collection_name, db_index):
+                        break
+                else:
+                    LOGGER.warning(f"{collection_name} counters of storage_{db_index} kept changing, left for the next run")
+
+        await self.dbs["tracking"]["state"].update_one(
+            {"_id": "counters"}, {"$set": {"reconciled_on": datetime.utcnow()}}, upsert=True
+        )
+        self.counters_ready = True
+
+    async def maintain_counters(self, interval: float) -> None:
+        while True:
+            try:
+                await self.reconcile_counters()
+            except Exception as e:
+                LOGGER.error(f"Counter reconciliation failed: {e}")
+            await sleep(interval)
+
+
+    # -------------------------------
+    # File Location Index
+    # -------------------------------
+
+    async def save_file_location(self, chat_id: int, msg_id: int, location: Dict[str, Any]) -> None:
+        try:
+            await self.dbs["tracking"]["file_index"].update_one(
+                {"_id": f"{chat_id}:{msg_id}"},
+                {"$set": {**location, "chat_id": chat_id, "msg_id": msg_id, "updated_on": datetime.utcnow()}},
+                upsert=True
+            )
+        except Exception as e:
+            LOGGER.error(f"Failed to index file location {chat_id}:{msg_id}: {e}")
+
+    async def get_file_location(self, chat_id: int, msg_id: int) -> Optional[Dict[str, Any]]:
+        try:
+            return await self.dbs["tracking"]["file_index"].find_one({"_id": f"{chat_id}:{msg_id}"})
+        except Exception as e:
+            LOGGER.error(f"Failed to read file location {chat_id}:{msg_id}: {e}")
+            return None
+
+    async def get_indexed_dcs(self) -> List[int]:
+        try:
+            return await self.dbs["tracking"]["file_index"].distinct("dc_id")
+        except Exception as e:
+            LOGGER.error(f"Failed to read indexed DCs: {e}")
+            return []
+
+    async def delete_file_locations(self, messages: List[Tuple[int, int]]) -> None:
+        try:
+            await self.dbs["tracking"]["file_index"].delete_many(
+                {"_id": {"$in": [f"{chat_id}:{msg_id}" for chat_id, msg_id in messages]}}
+            )
+        except Exception as e:
+            LOGGER.error(f"Failed to drop {len(messages)} file locations: {e}")
+
+    def _delete_files(self, file_ids) -> None:
+        # Deletes the Telegram messages behind stream ids, one batched call
+        # per chat, and drops their indexed locations.
+        file_ids = [file_id for file_id in file_ids if file_id]
+        decoded = decode_many(file_ids)
+        if len(decoded) < len(set(file_ids)):
+            LOGGER.error(f"Failed to decode {len(set(file_ids)) - len(decoded)} file ids queued for deletion")
+        by_chat: Dict[int, List[int]] = {}
+        for chat_id, msg_id in decoded.values():
+            by_chat.setdefault(int(f"-100{chat_id}"), []).append(msg_id)
+        for chat_id, msg_ids in by_chat.items():
+            create_task(delete_messages(chat_id, msg_ids))
+        if by_chat:
+            create_task(self.delete_file_locations(
+                [(chat_id, msg_id) for chat_id, msg_ids in by_chat.items() for msg_id in msg_ids]
+            ))
+
+
+    # -------------------------------
+    # Next Episode Lookup
+    # -------------------------------
+
+    async def get_next_episode_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        # Telegram entry of the episode following the one holding `file_id`,
+        # in the same quality when the next episode has it.
+        total_storage_dbs = len(self.dbs) - 1
+        found = await shard_executor.first(
+            "next_episode", range(1, total_storage_dbs + 1),
+            lambda db_index: self.dbs[f"storage_{db_index}"]["tv"].find_one(
+                {"seasons.episodes.telegram.id": file_id}, {"seasons": 1}
+            )
+        )
+        if not found:
+            return None
+        _, tv = found
+
+        episodes = sorted(
+            ((season.get("season_number", 0), episode.get("episode_number", 0), episode)
+             for season in tv.get("seasons", []) for episode in season.get("episodes", [])),
+            key=lambda e: (e[0], e[1])
+        )
+        for position, (_, _, episode) in enumerate(episodes[:-1]):
+            current = next((t for t in episode.get("telegram") or [] if t.get("id") == file_id), None)
+            if current is None:
+                continue
+            files = episodes[position + 1][2].get("telegram") or []
+            return next((t for t in files if t.get("quality") == current.get("quality")), files[0] if files else None)
+        return None
+
+
     # Get per-DB statistics (movies, tv shows, used size, etc.)
     async def get_database_stats(self):
-        stats = []
-        for key in self.dbs.keys():
-            if key.startswith("storage_"):
-                db = self.dbs[key]
-                movie_count = await db["movie"].count_documents({})
-                tv_count = await db["tv"].count_documents({})
-                db_stats = await db.command("dbstats")
-                stats.append({
-                    "db_name": key,
-                    "movie_count": movie_count,
-                    "tv_count": tv_count,
-                    "storageSize": db_stats.get("storageSize", 0),
-                    "dataSize": db_stats.get("dataSize", 0)
-                })
-        return stats
+        async def shard_stats(db_index: int) -> dict:
+            key = f"storage_{db_index}"
+            db = self.dbs[key]
+            movie_count, tv_count, db_stats = await gather(
+                db["movie"].count_documents({}),
+                db["tv"].count_documents({}),
+                db.command("dbstats")
+            )
+            return {
+                "db_name": key,
+                "movie_count": movie_count,
+                "tv_count": tv_count,
+                "storageSize": db_stats.get("storageSize", 0),
+                "dataSize": db_stats.get("dataSize", 0)
+            }
+
+        stats = await shard_executor.gather("stats", range(1, len(self.dbs)), shard_stats)
+        return list(stats.values())
+
+    async def count_all(self) -> Tuple[int, int]:
+        # Movie and TV show totals over the active storage DBs.
+        async def shard_counts(db_index: int) -> Tuple[int, int]:
+            db = self.dbs[f"storage_{db_index}"]
+            return await gather(db["movie"].count_documents({}), db["tv"].count_documents({}))
+
+        counts = await shard_executor.gather("count_all", range(1, self.current_db_index + 1), shard_counts)
+        return sum(movies for movies, _ in counts.values()), sum(tv for _, tv in counts.values())
@@ -1,9 +1,21 @@
 import zlib
 import json
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import struct
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
 
-executor = ThreadPoolExecutor()
+# Compact tokens: "_" + base64url(version, chat_id, msg_id, crc32 of the
+# rest). "_" never appears in base62, so legacy tokens are told apart by
+# their first character.
+TOKEN_PREFIX = "_"
+TOKEN_VERSION = 1
+TOKEN_BODY = struct.Struct(">BqI")
+TOKEN_CHECKSUM = struct.Struct(">I")
+TOKEN_CACHE_SIZE = 4096
+# Legacy tokens of a chat and message id are well under this; longer input
+# would only make the bignum decode slow.
+MAX_LEGACY_TOKEN = 256
 
 def compress_data(data):
     return zlib.compress(data.encode(), level=zlib.Z_BEST_COMPRESSION)
@@ -27,28 +39,57 @@ def base62_decode(data):
         num = num * 62 + BASE62_ALPHABET.index(char)
     return num.to_bytes((num.bit_length() + 7) // 8, 'big') or b'\0'
 
-async def async_compress_data(data):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(executor, compress_data, data)
+def encode_token(chat_id: int, msg_id: int) -> str:
+    body = TOKEN_BODY.pack(TOKEN_VERSION, int(chat_id), int(msg_id))
+    raw = body + TOKEN_CHECKSUM.pack(zlib.crc32(body))
+    return TOKEN_PREFIX + urlsafe_b64encode(raw).rstrip(b"=").decode()
 
-async def async_decompress_data(data):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(executor, decompress_data, data)
+def decode_legacy_token(token: str) -> Tuple[int, int]:
+    data = json.loads(decompress_data(base62_decode(token)))
+    return int(data["chat_id"]), int(data["msg_id"])
 
-async def async_base62_encode(data):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(executor, base62_encode, data)
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def decode_token(token: str) -> Tuple[int, int]:
+    # Returns (chat_id, msg_id) and raises ValueError for anything that is
+    # not a valid token of either format.
+    if not token.startswith(TOKEN_PREFIX):
+        if len(token) > MAX_LEGACY_TOKEN:
+            raise ValueError("invalid legacy token: too long")
+        try:
+            return decode_legacy_token(token)
+        except (ValueError, KeyError, TypeError, zlib.error) as e:
+            raise ValueError(f"invalid legacy token: {e}") from None
+    encoded = token[len(TOKEN_PREFIX):]
+    try:
+        raw = urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+    except (ValueError, TypeError):
+        raise ValueError("invalid token encoding") from None
+    if len(raw) != TOKEN_BODY.size + TOKEN_CHECKSUM.size:
+        raise ValueError("invalid token length")
+    body, (checksum,) = raw[:TOKEN_BODY.size], TOKEN_CHECKSUM.unpack(raw[TOKEN_BODY.size:])
+    if zlib.crc32(body) != checksum:
+        raise ValueError("token checksum mismatch")
+    version, chat_id, msg_id = TOKEN_BODY.unpack(body)
+    if version != TOKEN_VERSION:
+        raise ValueError(f"unsupported token version {version}")
+    return chat_id, msg_id
 
-async def async_base62_decode(data):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(executor, base62_decode, data)
+def encode_many(pairs: Iterable[Tuple[int, int]]) -> List[str]:
+    return [encode_token(chat_id, msg_id) for chat_id, msg_id in pairs]
+
+def decode_many(tokens: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+    # Tokens that do not decode are left out of the result.
+    decoded = {}
+    for token in tokens:
+        try:
+            decoded[token] = decode_token(token)
+        except ValueError:
+            continue
+    return decoded
 
 async def encode_string(data):
-    json_data = json.dumps(data)
-    compressed_data = await async_compress_data(json_data)
-    return await async_base62_encode(compressed_data)
+    return encode_token(data["chat_id"], data["msg_id"])
 
 async def decode_string(encoded_data):
-    compressed_data = await async_base62_decode(encoded_data)
-    json_data = await async_decompress_data(compressed_data)
-    return json.loads(json_data)
+    chat_id, msg_id = decode_token(encoded_data)
+    return {"chat_id": chat_id, "msg_id": msg_id}
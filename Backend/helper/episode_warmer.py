@@ -0,0 +1,94 @@
+import asyncio
+import PTN
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, Set
+from Backend import db
+from Backend.config import Telegram
+from Backend.logger import LOGGER
+from Backend.helper.chunk_cache import PART_SIZE, segment_cache
+from Backend.helper.custom_dl import ReadAheadBudget, get_streamer, read_ahead_budget
+from Backend.helper.encrypt import decode_token
+from Backend.pyrofork.scheduler import scheduler
+
+
+# Share of an episode a viewer has to get through before the next one is
+# warmed.
+WARM_AT = 0.9
+# How long a warmed episode is not warmed again.
+WARM_TTL = 30 * 60
+MAX_CONCURRENT_WARMUPS = 4
+MAX_REMEMBERED = 1024
+
+
+class EpisodeWarmer:
+    # Autoplay starts the next episode seconds after the current one ends.
+    # Once a viewer is near the end, the next episode's file location is
+    # resolved into the file cache, a media session to its DC is opened and
+    # its head and tail parts are pinned. Warmups draw on their own byte
+    # budget and are skipped outright while live streams are using most of
+    # the read-ahead budget.
+    def __init__(self, budget_bytes: int):
+        self.budget = ReadAheadBudget(budget_bytes)
+        self.recent: "OrderedDict[str, float]" = OrderedDict()
+        self.running: Set[asyncio.Task] = set()
+        self.stats: Dict[str, int] = {"warmed": 0, "no_next": 0, "skipped": 0, "failed": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget.max_bytes > 0
+
+    @staticmethod
+    def is_episode(file_name: str) -> bool:
+        try:
+            return bool(PTN.parse(file_name).get("episode"))
+        except Exception:
+            return False
+
+    def warm_after(self, file_id: str, file_name: str) -> None:
+        # Movies have no next episode; looking one up would only scan every
+        # storage shard's shows for nothing.
+        if not self.enabled or not self.is_episode(file_name):
+            return
+        now = monotonic()
+        if now - self.recent.get(file_id, -WARM_TTL) < WARM_TTL:
+            return
+        if len(self.running) >= MAX_CONCURRENT_WARMUPS or read_ahead_budget.in_flight > read_ahead_budget.max_bytes // 2:
+            self.stats["skipped"] += 1
+            return
+        self.recent[file_id] = now
+        self.recent.move_to_end(file_id)
+        while len(self.recent) > MAX_REMEMBERED:
+            self.recent.popitem(last=False)
+        task = asyncio.create_task(self.warm(file_id))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    async def warm(self, file_id: str) -> None:
+        try:
+            entry = await db.get_next_episode_file(file_id)
+            if not entry:
+                self.stats["no_next"] += 1
+                return
+            chat_id, message_id = decode_token(entry["id"])
+            chat_id = int(f"-100{chat_id}")
+
+            streamer = get_streamer(scheduler.pick())
+            next_file = await streamer.get_file_properties(chat_id, message_id)
+            streamer = get_streamer(scheduler.pick(next_file.dc_id))
+            await streamer.generate_media_session(streamer.client, next_file)
+
+            size = len(segment_cache.offsets(next_file.file_size)) * PART_SIZE
+            if segment_cache.enabled and self.budget.try_acquire(size):
+                try:
+                    await streamer.pin_segments(chat_id, message_id)
+                finally:
+                    self.budget.release(size)
+            self.stats["warmed"] += 1
+            LOGGER.debug(f"Warmed up next episode {entry.get('name', message_id)}")
+        except Exception as e:
+            self.stats["failed"] += 1
+            LOGGER.warning(f"Next episode warmup failed: {e}")
+
+
+episode_warmer = EpisodeWarmer(Telegram.WARMUP_BUDGET_MB * 1024 * 1024)
@@ -3,4 +3,8 @@ class InvalidHash(Exception):
 
 
 class FIleNotFound(Exception):
-    message = 'File not found!'
\ No newline at end of file
+    message = 'File not found!'
+
+
+class BudgetExhausted(Exception):
+    message = 'Read-ahead budget exhausted!'
@@ -0,0 +1,64 @@
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+from typing import Awaitable, Callable, Dict, Hashable, Set, Tuple
+from pyrogram.file_id import FileId
+from Backend.config import Telegram
+from Backend.logger import LOGGER
+from Backend.helper.single_flight import SingleFlight
+
+
+class FileIdCache:
+    # Size-bounded LRU of resolved FileIds shared by every client. Entries
+    # expire after `ttl` seconds; a hit in the last `refresh_ahead` fraction
+    # of an entry's life reloads it in the background so hot files never
+    # fall out of the cache.
+    def __init__(self, max_entries: int, ttl: float, refresh_ahead: float = 0.2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.entries: "OrderedDict[Hashable, Tuple[FileId, float]]" = OrderedDict()
+        self.refreshing: Set[Hashable] = set()
+        self.loads = SingleFlight()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "refreshes": 0}
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[FileId]]) -> FileId:
+        entry = self.entries.get(key)
+        now = monotonic()
+        if entry is not None:
+            file_id, expires_at = entry
+            if expires_at > now:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                if expires_at - now < self.ttl * self.refresh_ahead and key not in self.refreshing:
+                    self.refreshing.add(key)
+                    asyncio.create_task(self._refresh(key, loader))
+                return file_id
+            self.entries.pop(key, None)
+            self.stats["expirations"] += 1
+        self.stats["misses"] += 1
+        file_id = await self.loads.do(key, loader)
+        self.put(key, file_id)
+        return file_id
+
+    async def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[FileId]]) -> None:
+        try:
+            self.put(key, await self.loads.do(key, loader))
+            self.stats["refreshes"] += 1
+        except Exception as e:
+            LOGGER.debug(f"Background refresh of {key} failed: {e}")
+        finally:
+            self.refreshing.discard(key)
+
+    def put(self, key: Hashable, file_id: FileId) -> None:
+        self.entries[key] = (file_id, monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self.entries.pop(key, None)
+
+
+file_cache = FileIdCache(Telegram.FILE_CACHE_SIZE, Telegram.FILE_CACHE_TTL)
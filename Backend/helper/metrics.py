@@ -0,0 +1,183 @@
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+
+Labels = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{format_labels(self.labels, k)} {v}" for k, v in sorted(self.values.items())]
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, *labels: str, value: float) -> None:
+        self.values[labels] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> (per-bucket counts with +Inf last, sum)
+        self.series: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts, total = self.series.setdefault(labels, ([0] * (len(self.buckets) + 1), [0.0]))
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total[0]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    # Metrics recorded directly plus collectors that turn the stats dicts
+    # other modules already keep into samples when /metrics is scraped.
+    def __init__(self):
+        self.metrics: List = []
+        self.collectors: List[Callable[[], Iterable]] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func: Callable[[], Iterable]) -> Callable[[], Iterable]:
+        self.collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for collect in self.collectors:
+            for metric in collect():
+                lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+ttfb_seconds = registry.register(Histogram(
+    "tgstream_ttfb_seconds", "Time from receiving a /dl request to sending its first body byte."
+))
+getfile_seconds = registry.register(Histogram(
+    "tgstream_getfile_seconds", "Latency of one GetFile call.", labels=("dc", "bot")
+))
+bytes_served = registry.register(Counter(
+    "tgstream_bytes_served_total", "Body bytes sent to /dl clients."
+))
+active_streams = registry.register(Gauge(
+    "tgstream_active_streams", "/dl responses currently streaming."
+))
+aborted_streams = registry.register(Counter(
+    "tgstream_aborted_streams_total", "/dl responses that ended before their full body was sent.", labels=("reason",)
+))
+flood_waits = registry.register(Counter(
+    "tgstream_flood_waits_total", "FloodWait errors returned to a bot.", labels=("bot",)
+))
+getfile_errors = registry.register(Counter(
+    "tgstream_getfile_errors_total", "GetFile calls that failed with another error.", labels=("bot",)
+))
+shard_seconds = registry.register(Histogram(
+    "tgstream_shard_seconds", "Latency of one storage DB operation.", labels=("op", "shard")
+))
+shard_failures = registry.register(Counter(
+    "tgstream_shard_failures_total", "Storage DB operations left out of a fan-out.", labels=("op", "shard", "reason")
+))
+
+
+def labelled(metric, samples: Dict[Labels, float]):
+    metric.values.update(samples)
+    return metric
+
+
+@registry.collector
+def collect_stats():
+    from Backend.helper.chunk_cache import chunk_cache, segment_cache
+    from Backend.helper.custom_dl import read_ahead_budget, recovery_stats, stream_cursors
+    from Backend.helper.episode_warmer import episode_warmer
+    from Backend.helper.file_cache import file_cache
+    from Backend.helper.qos import stream_qos
+    from Backend.helper.single_flight import part_flights
+    from Backend.pyrofork.scheduler import scheduler
+
+    caches = {"chunk": chunk_cache.stats, "pinned": segment_cache.stats, "file": file_cache.stats}
+    yield labelled(Counter("tgstream_cache_requests_total", "Cache lookups by result.", ("cache", "result")), {
+        (name, result): stats[key] for name, stats in caches.items() for result, key in (("hit", "hits"), ("miss", "misses"))
+    })
+    yield labelled(Gauge("tgstream_cache_hit_ratio", "Share of cache lookups that hit since startup.", ("cache",)), {
+        (name,): stats["hits"] / (stats["hits"] + stats["misses"]) for name, stats in caches.items() if stats["hits"] + stats["misses"]
+    })
+
+    clients = sorted(scheduler.clients.items())
+    yield labelled(Gauge("tgstream_bot_active_streams", "Streams assigned to each bot.", ("bot",)), {
+        (str(index),): stats.active for index, stats in clients
+    })
+    yield labelled(Counter("tgstream_bot_bytes_total", "Bytes each bot fetched from Telegram.", ("bot",)), {
+        (str(index),): stats.total_bytes for index, stats in clients
+    })
+    yield labelled(Gauge("tgstream_bot_available", "Whether each bot is currently picked for new streams.", ("bot",)), {
+        (str(index),): int(scheduler.available(index)) for index, _ in clients
+    })
+
+    yield labelled(Counter("tgstream_part_fetches_total", "Part requests by whether they hit Telegram or joined a running fetch.", ("result",)), {
+        ("fetched",): part_flights.stats["fetches"], ("coalesced",): part_flights.stats["coalesced"]
+    })
+    yield labelled(Gauge("tgstream_read_ahead_bytes", "Bytes currently requested ahead of readers."), {
+        (): read_ahead_budget.in_flight
+    })
+    yield labelled(Counter("tgstream_recoveries_total", "Stream recovery actions.", ("action",)), {
+        (action,): count for action, count in recovery_stats.items()
+    })
+    yield labelled(Counter("tgstream_cursor_events_total", "Parked upstream cursor events.", ("event",)), {
+        (event,): count for event, count in stream_cursors.stats.items()
+    })
+    yield labelled(Gauge("tgstream_parked_cursors", "Upstream cursors currently parked."), {
+        (): len(stream_cursors.cursors)
+    })
+    yield labelled(Counter("tgstream_episode_warmups_total", "Next-episode warmups by outcome.", ("result",)), {
+        (result,): count for result, count in episode_warmer.stats.items()
+    })
+    yield labelled(Counter("tgstream_qos_rejections_total", "Streams refused by QoS.", ("scope",)), {
+        ("viewer",): stream_qos.stats["rejected_viewer"], ("global",): stream_qos.stats["rejected_global"]
+    })
+    yield labelled(Counter("tgstream_qos_throttled_seconds_total", "Time streams were held back by QoS pacing."), {
+        (): round(stream_qos.stats["throttled_seconds"], 3)
+    })
@@ -1,4 +1,4 @@
-from pyrogram.file_id import FileId
+from pyrogram.file_id import FileId, FileType
 from typing import Optional
 from Backend.logger import LOGGER
 from Backend import __version__, now, timezone
@@ -17,6 +17,46 @@ def is_media(message):
     return next((getattr(message, attr) for attr in ["document", "photo", "video", "audio", "voice", "video_note", "sticker", "animation"] if getattr(message, attr)), None)
 
 
+def build_file_id(media) -> FileId:
+    file_id_obj = FileId.decode(media.file_id)
+    setattr(file_id_obj, 'file_name', getattr(media, 'file_name', ''))
+    setattr(file_id_obj, 'file_size', getattr(media, 'file_size', 0))
+    setattr(file_id_obj, 'mime_type', getattr(media, 'mime_type', ''))
+    setattr(file_id_obj, 'unique_id', media.file_unique_id)
+    return file_id_obj
+
+
+def file_id_to_location(file_id: FileId) -> dict:
+    return {
+        "file_type": file_id.file_type.value,
+        "dc_id": file_id.dc_id,
+        "media_id": file_id.media_id,
+        "access_hash": file_id.access_hash,
+        "file_reference": file_id.file_reference,
+        "thumbnail_size": file_id.thumbnail_size,
+        "file_size": int(getattr(file_id, 'file_size', 0) or 0),
+        "mime_type": getattr(file_id, 'mime_type', '') or '',
+        "file_name": getattr(file_id, 'file_name', '') or '',
+        "unique_id": getattr(file_id, 'unique_id', ''),
+    }
+
+
+def file_id_from_location(location: dict) -> FileId:
+    file_id_obj = FileId(
+        file_type=FileType(location["file_type"]),
+        dc_id=location["dc_id"],
+        media_id=location["media_id"],
+        access_hash=location["access_hash"],
+        file_reference=bytes(location["file_reference"]),
+        thumbnail_size=location.get("thumbnail_size", ""),
+    )
+    setattr(file_id_obj, 'file_name', location.get("file_name", ''))
+    setattr(file_id_obj, 'file_size', location.get("file_size", 0))
+    setattr(file_id_obj, 'mime_type', location.get("mime_type", ''))
+    setattr(file_id_obj, 'unique_id', location.get("unique_id", ''))
+    return file_id_obj
+
+
 async def get_file_ids(client: Client, chat_id: int, message_id: int) -> Optional[FileId]:
     try:
         message = await client.get_messages(chat_id, message_id)
@@ -24,15 +64,7 @@ async def get_file_ids(client: Client, chat_id: int, message_id: int) -> Optiona
             raise FIleNotFound("Message not found or empty")
         
         if media := is_media(message):
-            file_id_obj = FileId.decode(media.file_id)
-            file_unique_id = media.file_unique_id
-            
-            setattr(file_id_obj, 'file_name', getattr(media, 'file_name', ''))
-            setattr(file_id_obj, 'file_size', getattr(media, 'file_size', 0))
-            setattr(file_id_obj, 'mime_type', getattr(media, 'mime_type', ''))
-            setattr(file_id_obj, 'unique_id', file_unique_id)
-            
-            return file_id_obj
+            return build_file_id(media)
         else:
             raise FIleNotFound("No supported media found in message")
     except Exception as e:
@@ -0,0 +1,174 @@
+import asyncio
+import math
+from time import monotonic
+from typing import Dict, Hashable, Optional, Tuple
+from fastapi import HTTPException
+from Backend.config import Telegram
+from Backend.logger import LOGGER
+
+
+# Seconds of traffic a bucket may send at once after being idle.
+BURST_SECONDS = 4
+# Connections a viewer may hold to one file before further ones count as
+# bulk download rather than playback.
+PLAYBACK_CONNECTIONS = 2
+MAX_BUCKETS = 10000
+
+
+class TokenBucket:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.burst = rate * BURST_SECONDS
+        self.tokens = self.burst
+        self.updated = monotonic()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount: int) -> float:
+        # Takes `amount` even into debt and returns how long the caller has
+        # to wait for the debt to be paid back.
+        self._refill()
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def backlog(self) -> float:
+        self._refill()
+        return max(0.0, -self.tokens / self.rate)
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class StreamGrant:
+    def __init__(self, qos: "StreamQoS", ip: str, token: Hashable, media_id: int, bulk: bool):
+        self.qos = qos
+        self.ip = ip
+        self.token = token
+        self.media_id = media_id
+        self.bulk = bulk
+        self.released = False
+
+    async def pace(self, size: int) -> None:
+        delay = self.qos.consume(self, size)
+        if delay > 0:
+            self.qos.stats["throttled_seconds"] += delay
+            await asyncio.sleep(delay)
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.qos.release(self)
+
+
+class StreamQoS:
+    # Token buckets on bytes served: one per client IP, one per stream link
+    # and a global egress cap. Connections beyond the first couple a viewer
+    # opens to the same file are treated as bulk download and also draw from
+    # a smaller bulk bucket, so download managers cannot crowd out playback.
+    # A request whose buckets are too far in debt is turned away with 429
+    # (its own limits) or 503 (server-wide) and a Retry-After instead of
+    # being queued.
+    def __init__(self, ip_rate: float, token_rate: float, global_rate: float, bulk_share: float, ip_streams: int, max_delay: float):
+        self.ip_rate = ip_rate
+        self.token_rate = token_rate
+        self.ip_streams = ip_streams
+        self.max_delay = max_delay
+        self.global_bucket = TokenBucket(global_rate) if global_rate > 0 else None
+        bulk_rate = global_rate * bulk_share
+        self.bulk_bucket = TokenBucket(bulk_rate) if bulk_rate > 0 else None
+        self.ip_buckets: Dict[str, TokenBucket] = {}
+        self.token_buckets: Dict[Hashable, TokenBucket] = {}
+        self.streams: Dict[str, int] = {}
+        self.file_streams: Dict[Tuple[str, int], int] = {}
+        self.stats: Dict[str, float] = {
+            "admitted": 0, "bulk": 0, "rejected_viewer": 0, "rejected_global": 0, "throttled_seconds": 0.0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.ip_rate > 0 or self.token_rate > 0 or self.global_bucket or self.ip_streams > 0)
+
+    def _bucket(self, buckets: Dict[Hashable, TokenBucket], key: Hashable, rate: float) -> Optional[TokenBucket]:
+        if rate <= 0:
+            return None
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= MAX_BUCKETS:
+                for stale in [k for k, b in buckets.items() if b.idle]:
+                    del buckets[stale]
+            bucket = buckets[key] = TokenBucket(rate)
+        return bucket
+
+    def _reject(self, status_code: int, wait: float, reason: str) -> None:
+        self.stats["rejected_viewer" if status_code == 429 else "rejected_global"] += 1
+        retry_after = max(1, math.ceil(wait))
+        LOGGER.debug(f"Stream rejected with {status_code}: {reason}, retry after {retry_after}s")
+        raise HTTPException(status_code=status_code, detail=reason, headers={"Retry-After": str(retry_after)})
+
+    def admit(self, ip: str, token: Hashable, media_id: int) -> Optional[StreamGrant]:
+        if not self.enabled:
+            return None
+        if self.ip_streams > 0 and self.streams.get(ip, 0) >= self.ip_streams:
+            self._reject(429, BURST_SECONDS, "Too many concurrent streams")
+        for bucket in (self._bucket(self.ip_buckets, ip, self.ip_rate), self._bucket(self.token_buckets, token, self.token_rate)):
+            wait = bucket.backlog() if bucket else 0
+            if wait > self.max_delay:
+                self._reject(429, wait - self.max_delay, "Bandwidth limit reached")
+
+        bulk = self.file_streams.get((ip, media_id), 0) >= PLAYBACK_CONNECTIONS
+        if self.global_bucket:
+            # Playback may run the global bucket up to the full delay; bulk
+            # is refused as soon as it is in debt at all.
+            wait = self.global_bucket.backlog()
+            if bulk and wait > 0:
+                self._reject(503, wait, "Server busy with playback")
+            if bulk and self.bulk_bucket and self.bulk_bucket.backlog() > self.max_delay:
+                self._reject(503, self.bulk_bucket.backlog() - self.max_delay, "Bulk bandwidth exhausted")
+            if wait > self.max_delay:
+                self._reject(503, wait - self.max_delay, "Server bandwidth exhausted")
+
+        self.streams[ip] = self.streams.get(ip, 0) + 1
+        self.file_streams[(ip, media_id)] = self.file_streams.get((ip, media_id), 0) + 1
+        self.stats["admitted"] += 1
+        if bulk:
+            self.stats["bulk"] += 1
+        return StreamGrant(self, ip, token, media_id, bulk)
+
+    def consume(self, grant: StreamGrant, size: int) -> float:
+        buckets = [
+            self._bucket(self.ip_buckets, grant.ip, self.ip_rate),
+            self._bucket(self.token_buckets, grant.token, self.token_rate),
+            self.global_bucket,
+            self.bulk_bucket if grant.bulk else None,
+        ]
+        return max((bucket.consume(size) for bucket in buckets if bucket), default=0.0)
+
+    def release(self, grant: StreamGrant) -> None:
+        for counts, key in ((self.streams, grant.ip), (self.file_streams, (grant.ip, grant.media_id))):
+            counts[key] -= 1
+            if counts[key] <= 0:
+                del counts[key]
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            **self.stats,
+            "throttled_seconds": round(self.stats["throttled_seconds"], 1),
+            "active_viewers": len(self.streams),
+            "global_backlog_seconds": round(self.global_bucket.backlog(), 2) if self.global_bucket else 0,
+        }
+
+
+MB = 1024 * 1024
+stream_qos = StreamQoS(
+    Telegram.QOS_IP_RATE_MB * MB,
+    Telegram.QOS_TOKEN_RATE_MB * MB,
+    Telegram.QOS_GLOBAL_RATE_MB * MB,
+    Telegram.QOS_BULK_SHARE,
+    Telegram.QOS_IP_STREAMS,
+    Telegram.QOS_MAX_DELAY,
+)
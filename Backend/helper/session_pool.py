@@ -0,0 +1,175 @@
+import asyncio
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Tuple
+from pyrogram import Client, raw
+from pyrogram.errors import AuthBytesInvalid
+from pyrogram.session import Session, Auth
+from Backend.config import Telegram
+from Backend.helper.cdn import cdn_directory
+from Backend.logger import LOGGER
+
+# pyrogram restarts a session on network errors by stopping and starting it,
+# so a stopped session is only given up on after this long.
+RESTART_GRACE = 30
+
+
+class DCPool:
+    def __init__(self):
+        self.auth_key: Optional[bytes] = None
+        self.sessions: List[Session] = []
+        self.down_since: Dict[Session, float] = {}
+        self.lock = asyncio.Lock()
+
+
+class MediaSessionPool:
+    # Several media sessions per (client, DC) so parallel part fetches are
+    # spread over separate MTProto connections. Sessions of one DC share a
+    # single auth key, so the Export/ImportAuthorization round trip is paid
+    # once per client and DC rather than once per session. CDN DCs get
+    # pools of their own; they only need an auth key, no authorization.
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.pools: Dict[Tuple[int, int, bool], DCPool] = {}
+
+    async def acquire(self, index: int, client: Client, dc_id: int, cdn: bool = False) -> Optional[Session]:
+        pool = self.pools.setdefault((index, dc_id, cdn), DCPool())
+        healthy = [s for s in pool.sessions if s.is_started.is_set()]
+        if not healthy:
+            async with pool.lock:
+                await self._fill(pool, client, dc_id, cdn)
+            healthy = [s for s in pool.sessions if s.is_started.is_set()]
+            if not healthy:
+                healthy = await self._wait_restart(pool)
+            if not healthy:
+                return None
+        elif len(healthy) < self.size and not pool.lock.locked():
+            asyncio.create_task(self._refill(index, pool, client, dc_id, cdn))
+        return min(healthy, key=lambda s: len(s.results))
+
+    async def _refill(self, index: int, pool: DCPool, client: Client, dc_id: int, cdn: bool = False) -> None:
+        try:
+            async with pool.lock:
+                await self._fill(pool, client, dc_id, cdn)
+        except Exception as e:
+            LOGGER.warning(f"Could not restore media sessions of client {index} for DC {dc_id}: {e}")
+
+    async def replace(self, index: int, session: Session) -> None:
+        pool = self.pools.get((index, session.dc_id, session.is_cdn))
+        if pool and session in pool.sessions:
+            pool.sessions.remove(session)
+            pool.down_since.pop(session, None)
+        LOGGER.debug(f"Replacing media session of client {index} for DC {session.dc_id}")
+        try:
+            await session.stop()
+        except Exception:
+            pass
+
+    async def _wait_restart(self, pool: DCPool) -> List[Session]:
+        # Sessions pyrogram is restarting still hold their slots; wait for
+        # one of them rather than fail the caller.
+        restarting = [asyncio.create_task(s.is_started.wait()) for s in pool.sessions]
+        if not restarting:
+            return []
+        await asyncio.wait(restarting, timeout=RESTART_GRACE, return_when=asyncio.FIRST_COMPLETED)
+        for task in restarting:
+            task.cancel()
+        return [s for s in pool.sessions if s.is_started.is_set()]
+
+    async def _evict_dead(self, pool: DCPool) -> None:
+        # A session that has been stopped for longer than a restart takes is
+        # stopped for good before it is dropped, so one that is still coming
+        # back never ends up running outside the pool.
+        now = monotonic()
+        for session in list(pool.sessions):
+            if session.is_started.is_set():
+                pool.down_since.pop(session, None)
+                continue
+            if now - pool.down_since.setdefault(session, now) < RESTART_GRACE:
+                continue
+            pool.sessions.remove(session)
+            pool.down_since.pop(session, None)
+            try:
+                await session.stop()
+            except Exception:
+                pass
+
+    async def _fill(self, pool: DCPool, client: Client, dc_id: int, cdn: bool = False) -> None:
+        await self._evict_dead(pool)
+        missing = self.size - len(pool.sessions)
+        if missing <= 0:
+            return
+        if pool.auth_key is None:
+            first = await self._create_first(pool, client, dc_id, cdn)
+            if first is None:
+                return
+            pool.sessions.append(first)
+            missing -= 1
+        started = await asyncio.gather(
+            *(self._start(client, dc_id, pool.auth_key, cdn) for _ in range(missing)),
+            return_exceptions=True
+        )
+        pool.sessions.extend(s for s in started if isinstance(s, Session))
+        LOGGER.debug(f"Media session pool for DC {dc_id} has {len(pool.sessions)} sessions")
+
+    async def _start(self, client: Client, dc_id: int, auth_key: bytes, cdn: bool = False) -> Session:
+        session = Session(client, dc_id, auth_key, await client.storage.test_mode(), is_media=True, is_cdn=cdn)
+        await session.start()
+        return session
+
+    async def _create_first(self, pool: DCPool, client: Client, dc_id: int, cdn: bool = False) -> Optional[Session]:
+        if cdn:
+            await cdn_directory.prepare(client, dc_id)
+            pool.auth_key = await Auth(client, dc_id, await client.storage.test_mode()).create()
+            return await self._start(client, dc_id, pool.auth_key, cdn=True)
+
+        if dc_id == await client.storage.dc_id():
+            pool.auth_key = await client.storage.auth_key()
+            return await self._start(client, dc_id, pool.auth_key)
+
+        auth_key = await Auth(client, dc_id, await client.storage.test_mode()).create()
+        session = await self._start(client, dc_id, auth_key)
+        for _ in range(6):
+            exported_auth = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+            try:
+                await session.send(raw.functions.auth.ImportAuthorization(id=exported_auth.id, bytes=exported_auth.bytes))
+                break
+            except AuthBytesInvalid:
+                LOGGER.debug(f"Invalid authorization bytes for DC {dc_id}, retrying...")
+            except OSError:
+                LOGGER.debug(f"Connection error, retrying...")
+                await asyncio.sleep(2)
+        else:
+            await session.stop()
+            LOGGER.debug(f"Failed to establish media session for DC {dc_id} after multiple retries")
+            return None
+        pool.auth_key = auth_key
+        return session
+
+    async def prewarm(self, clients: Dict[int, Client], dc_ids: Iterable[int]) -> None:
+        dc_ids = sorted(set(dc_ids))
+        if not dc_ids:
+            return
+        LOGGER.info(f"Prewarming media sessions for DCs {dc_ids} on {len(clients)} clients")
+        results = await asyncio.gather(
+            *(self.acquire(index, client, dc_id) for index, client in clients.items() for dc_id in dc_ids),
+            return_exceptions=True
+        )
+        failed = sum(1 for r in results if not isinstance(r, Session))
+        if failed:
+            LOGGER.warning(f"{failed} media session pools could not be prewarmed")
+
+    async def health_check(self, clients: Dict[int, Client], interval: int = 60) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            for (index, dc_id, cdn), pool in list(self.pools.items()):
+                healthy = sum(1 for s in pool.sessions if s.is_started.is_set())
+                if index in clients and healthy < self.size and not pool.lock.locked():
+                    await self._refill(index, pool, clients[index], dc_id, cdn)
+
+    async def close(self) -> None:
+        sessions = [s for pool in self.pools.values() for s in pool.sessions]
+        self.pools.clear()
+        await asyncio.gather(*(s.stop() for s in sessions), return_exceptions=True)
+
+
+session_pool = MediaSessionPool(Telegram.MEDIA_SESSIONS_PER_DC)
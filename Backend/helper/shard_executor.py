@@ -0,0 +1,80 @@
+import asyncio
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+from Backend.config import Telegram
+from Backend.logger import LOGGER
+from Backend.helper.metrics import shard_failures, shard_seconds
+
+
+class ShardExecutor:
+    # Runs one operation per storage DB concurrently. A shard that fails or
+    # does not answer within the timeout is left out of the result, so one
+    # slow or unreachable cluster degrades a page instead of failing it.
+    # Lookups whose answer decides a write pass strict=True and get the
+    # error instead of a partial result.
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.stats: Dict[int, Dict[str, float]] = {}
+
+    def _record(self, shard: int, elapsed: float, outcome: Optional[str]) -> None:
+        stats = self.stats.setdefault(shard, {"calls": 0, "error": 0, "timeout": 0, "seconds": 0.0, "max_seconds": 0.0})
+        stats["calls"] += 1
+        stats["seconds"] += elapsed
+        stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+        if outcome:
+            stats[outcome] += 1
+
+    async def _run(self, op: str, shard: int, func: Callable[[int], Awaitable[Any]]) -> Any:
+        started = monotonic()
+        outcome = None
+        try:
+            return await asyncio.wait_for(func(shard), self.timeout)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise TimeoutError(f"no answer within {self.timeout}s") from None
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            elapsed = monotonic() - started
+            self._record(shard, elapsed, outcome)
+            shard_seconds.observe(elapsed, op, str(shard))
+            if outcome:
+                shard_failures.inc(op, str(shard), outcome)
+
+    async def gather(
+        self, op: str, shards: Iterable[int], func: Callable[[int], Awaitable[Any]], strict: bool = False
+    ) -> Dict[int, Any]:
+        shards = list(shards)
+        outcomes = await asyncio.gather(*(self._run(op, shard, func) for shard in shards), return_exceptions=True)
+        results = {}
+        for shard, outcome in zip(shards, outcomes):
+            if isinstance(outcome, BaseException):
+                if strict:
+                    raise outcome
+                LOGGER.warning(f"storage_{shard} left out of {op}: {outcome}")
+                continue
+            results[shard] = outcome
+        return results
+
+    async def first(
+        self, op: str, shards: Iterable[int], func: Callable[[int], Awaitable[Any]], strict: bool = False
+    ) -> Optional[Tuple[int, Any]]:
+        # The first shard, in the given order, with a truthy result.
+        results = await self.gather(op, shards, func, strict)
+        return next(((shard, result) for shard, result in results.items() if result), None)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {
+            f"storage_{shard}": {
+                "calls": stats["calls"],
+                "errors": stats["error"],
+                "timeouts": stats["timeout"],
+                "avg_ms": round(stats["seconds"] / stats["calls"] * 1000, 1) if stats["calls"] else 0,
+                "max_ms": round(stats["max_seconds"] * 1000, 1),
+            }
+            for shard, stats in sorted(self.stats.items())
+        }
+
+
+shard_executor = ShardExecutor(Telegram.SHARD_TIMEOUT)
@@ -0,0 +1,63 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class SingleFlight:
+    # Concurrent callers asking for the same key share one running task
+    # instead of each issuing their own request. Waiters are counted: one
+    # caller going away leaves the fetch running for the others, and the
+    # task is cancelled once the last waiter is gone.
+    def __init__(self):
+        self.in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.waiters: Dict[asyncio.Task, int] = {}
+        self.stats: Dict[str, int] = {"fetches": 0, "coalesced": 0}
+
+    def _running(self, key: Hashable) -> Optional[asyncio.Task]:
+        # A task that is done or being cancelled is never handed out; its
+        # key is free for a new fetch.
+        task = self.in_flight.get(key)
+        if task is not None and (task.done() or task.cancelling()):
+            del self.in_flight[key]
+            return None
+        return task
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._running(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.stats["fetches"] += 1
+        else:
+            self.stats["coalesced"] += 1
+        return await self._wait(key, task)
+
+    async def join(self, key: Hashable) -> Optional[Any]:
+        # Result of the running task for `key`, or None when there is none.
+        task = self._running(key)
+        if task is None:
+            return None
+        self.stats["coalesced"] += 1
+        return await self._wait(key, task)
+
+    async def _wait(self, key: Hashable, task: asyncio.Task) -> Any:
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self.waiters[task] -= 1
+            if not self.waiters[task]:
+                del self.waiters[task]
+                if not task.done():
+                    if self.in_flight.get(key) is task:
+                        del self.in_flight[key]
+                    task.cancel()
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        if not task.cancelled():
+            task.exception()
+
+
+part_flights = SingleFlight()
@@ -25,5 +25,4 @@ Helper = Client(
 )
 
 
-multi_clients = {}
-work_loads = {}
\ No newline at end of file
+multi_clients = {}
\ No newline at end of file
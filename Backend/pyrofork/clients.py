@@ -2,7 +2,8 @@ from asyncio import gather, create_task
 from pyrogram import Client
 from Backend.logger import LOGGER
 from Backend.config import Telegram
-from Backend.pyrofork.bot import multi_clients, work_loads, StreamBot
+from Backend.pyrofork.bot import multi_clients, StreamBot
+from Backend.pyrofork.scheduler import scheduler
 from os import environ
 
 class TokenParser:
@@ -31,14 +32,15 @@ async def start_client(client_id, token):
             no_updates=True,
             in_memory=True
         ).start()
-        work_loads[client_id] = 0
+        scheduler.register(client_id)
         return client_id, client
     except Exception as e:
         LOGGER.error(f"Failed to start Client - {client_id} Error: {e}", exc_info=True)
         return None
 
 async def initialize_clients():
-    multi_clients[0], work_loads[0] = StreamBot, 0
+    multi_clients[0] = StreamBot
+    scheduler.register(0)
     all_tokens = TokenParser.parse_from_env()
     if not all_tokens:
         LOGGER.info("No additional Bot Clients found, Using default client")
@@ -51,12 +51,7 @@ async def fix_metadata_handler(_, message):
     # -------------------------
     # Gather totals quickly (non-blocking)
     # -------------------------
-    total_movies = 0
-    total_tv = 0
-    for i in range(1, db.current_db_index + 1):
-        key = f"storage_{i}"
-        total_movies += await db.dbs[key]["movie"].count_documents({})
-        total_tv += await db.dbs[key]["tv"].count_documents({})
+    total_movies, total_tv = await db.count_all()
 
     TOTAL = total_movies + total_tv
     DONE = 0
@@ -422,6 +417,13 @@ async def fix_metadata_handler(_, message):
     except Exception as e:
         LOGGER.exception(f"Error in fix_metadata run: {e}")
 
+    # Genres were rewritten in place, so recount instead of adjusting the
+    # catalog counters per document.
+    try:
+        await db.reconcile_counters()
+    except Exception as e:
+        LOGGER.error(f"Counter reconciliation after fix_metadata failed: {e}")
+
     if CANCEL_REQUESTED:
         try:
             await status.edit_text("❌ Metadata fixing cancelled by user.")
@@ -4,8 +4,9 @@ from Backend.helper.task_manager import edit_message
 from Backend.logger import LOGGER
 from Backend import db
 from Backend.config import Telegram
-from Backend.helper.pyro import clean_filename, get_readable_file_size, remove_urls
+from Backend.helper.pyro import build_file_id, clean_filename, file_id_to_location, get_readable_file_size, remove_urls
 from Backend.helper.metadata import metadata
+from Backend.helper.custom_dl import pin_file_segments
 from pyrogram import filters, Client
 from pyrogram.types import Message
 from pyrogram.errors import FloodWait
@@ -18,13 +19,21 @@ db_lock = Lock()
 async def process_file():
     while True:
         metadata_info, channel, msg_id, size, title = await file_queue.get()
-        async with db_lock:
-            updated_id = await db.insert_media(metadata_info, channel=channel, msg_id=msg_id, size=size, name=title)
-            if updated_id:
-                LOGGER.info(f"{metadata_info['media_type']} updated with ID: {updated_id}")
-            else:
-                LOGGER.info("Update failed due to validation errors.")
-        file_queue.task_done()
+        try:
+            async with db_lock:
+                updated_id = await db.insert_media(metadata_info, channel=channel, msg_id=msg_id, size=size, name=title)
+                if updated_id:
+                    LOGGER.info(f"{metadata_info['media_type']} updated with ID: {updated_id}")
+                    if Telegram.PIN_ON_INGEST:
+                        create_task(pin_file_segments(int(f"-100{channel}"), msg_id))
+                else:
+                    LOGGER.info("Update failed due to validation errors.")
+        except Exception as e:
+            # A storage shard that is down or slow fails the lookup for
+            # duplicates; skip the file rather than lose the worker.
+            LOGGER.error(f"Failed to save {title} (ID: {msg_id}): {e}")
+        finally:
+            file_queue.task_done()
 
 for _ in range(1):
     create_task(process_file())
@@ -36,6 +45,7 @@ async def file_receive_handler(client: Client, message: Message):
         try:
             if message.video or (message.document and message.document.mime_type.startswith("video/")):
                 file = message.video or message.document
+                create_task(db.save_file_location(message.chat.id, message.id, file_id_to_location(build_file_id(file))))
                 title = message.caption or file.file_name
                 msg_id = message.id
                 size = get_readable_file_size(file.file_size)
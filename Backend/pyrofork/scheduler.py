@@ -0,0 +1,149 @@
+from datetime import date
+from time import monotonic
+from typing import Dict, Iterable, List, Optional
+from Backend.config import Telegram
+from Backend.logger import LOGGER
+
+
+# Throughput assumed for a client (or DC) nothing has been measured on yet.
+DEFAULT_SPEED = 4 * 1024 * 1024
+# Demand a newly assigned stream is expected to add before it is measured.
+NEW_STREAM_RATE = 1024 * 1024
+RATE_WINDOW = 10
+ERROR_THRESHOLD = 3
+ERROR_COOLDOWN = 30
+
+
+class ClientStats:
+    def __init__(self):
+        self.active = 0
+        self.speed: Optional[float] = None
+        self.dc_speed: Dict[int, float] = {}
+        self.window_start = monotonic()
+        self.window_bytes = 0
+        self.rate = 0.0
+        self.total_bytes = 0
+        self.day = date.today()
+        self.bytes_today = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.flood_waits = 0
+        self.penalised_until = 0.0
+
+    def add_bytes(self, size: int) -> None:
+        now = monotonic()
+        elapsed = now - self.window_start
+        if elapsed >= RATE_WINDOW:
+            self.rate = self.window_bytes / elapsed
+            self.window_start, self.window_bytes = now, 0
+        self.window_bytes += size
+        self.total_bytes += size
+        today = date.today()
+        if today != self.day:
+            self.day, self.bytes_today = today, 0
+        self.bytes_today += size
+
+    def current_rate(self) -> float:
+        elapsed = monotonic() - self.window_start
+        if elapsed >= RATE_WINDOW:
+            return self.window_bytes / elapsed
+        return max(self.rate, self.window_bytes / max(elapsed, 1.0))
+
+
+class ClientScheduler:
+    # Assigns streams to bot clients by weighted least load: the traffic a
+    # client is already carrying, plus a share for each open stream, divided
+    # by how fast it has been fetching from the file's DC. Clients in
+    # FloodWait, cooling down after repeated errors or over the daily
+    # transfer limit are only used when nothing else is left.
+    def __init__(self):
+        self.clients: Dict[int, ClientStats] = {}
+
+    def register(self, index: int) -> None:
+        self.clients.setdefault(index, ClientStats())
+
+    def acquire(self, index: int) -> None:
+        self.clients[index].active += 1
+
+    def release(self, index: int) -> None:
+        self.clients[index].active -= 1
+
+    def record_transfer(self, index: int, dc_id: int, size: int, elapsed: float) -> None:
+        stats = self.clients[index]
+        stats.add_bytes(size)
+        stats.consecutive_errors = 0
+        if size and elapsed > 0:
+            speed = size / elapsed
+            stats.speed = speed if stats.speed is None else stats.speed * 0.8 + speed * 0.2
+            previous = stats.dc_speed.get(dc_id)
+            stats.dc_speed[dc_id] = speed if previous is None else previous * 0.8 + speed * 0.2
+
+    def record_error(self, index: int) -> None:
+        stats = self.clients[index]
+        stats.errors += 1
+        stats.consecutive_errors += 1
+        if stats.consecutive_errors >= ERROR_THRESHOLD:
+            stats.penalised_until = max(stats.penalised_until, monotonic() + ERROR_COOLDOWN)
+            LOGGER.warning(f"Client {index} cooling down for {ERROR_COOLDOWN}s after {stats.consecutive_errors} errors")
+
+    def record_flood_wait(self, index: int, seconds: float) -> None:
+        stats = self.clients[index]
+        stats.flood_waits += 1
+        stats.penalised_until = max(stats.penalised_until, monotonic() + seconds)
+        LOGGER.warning(f"Client {index} in FloodWait for {seconds}s")
+
+    def available(self, index: int) -> bool:
+        stats = self.clients[index]
+        if stats.penalised_until > monotonic():
+            return False
+        limit = Telegram.DAILY_TRANSFER_GB * 1024 ** 3
+        return not limit or stats.bytes_today < limit
+
+    def speed(self, index: int, dc_id: Optional[int] = None) -> float:
+        stats = self.clients[index]
+        if dc_id is not None and dc_id in stats.dc_speed:
+            return stats.dc_speed[dc_id]
+        return stats.speed or DEFAULT_SPEED
+
+    def score(self, index: int, dc_id: Optional[int] = None) -> float:
+        stats = self.clients[index]
+        return (stats.current_rate() + (stats.active + 1) * NEW_STREAM_RATE) / self.speed(index, dc_id)
+
+    def pick_many(self, count: int, dc_id: Optional[int] = None, exclude: Iterable[int] = ()) -> List[int]:
+        excluded = set(exclude)
+        candidates = [i for i in self.clients if i not in excluded]
+        ready = [i for i in candidates if self.available(i)] or candidates
+        return sorted(ready, key=lambda i: self.score(i, dc_id))[:count]
+
+    def pick(self, dc_id: Optional[int] = None, exclude: Iterable[int] = ()) -> int:
+        picked = self.pick_many(1, dc_id, exclude)
+        return picked[0] if picked else 0
+
+    def loads(self) -> Dict[str, int]:
+        return {
+            f"bot{c + 1}": stats.active
+            for c, (_, stats) in enumerate(
+                sorted(self.clients.items(), key=lambda x: x[1].active, reverse=True)
+            )
+        }
+
+    def snapshot(self) -> Dict[str, dict]:
+        now = monotonic()
+        return {
+            f"bot{index + 1}": {
+                "active_streams": stats.active,
+                "rate_bytes_per_sec": round(stats.current_rate()),
+                "speed_bytes_per_sec": round(stats.speed or 0),
+                "dc_speed_bytes_per_sec": {str(dc): round(s) for dc, s in stats.dc_speed.items()},
+                "bytes_today": stats.bytes_today,
+                "total_bytes": stats.total_bytes,
+                "errors": stats.errors,
+                "flood_waits": stats.flood_waits,
+                "cooldown_seconds": max(0, round(stats.penalised_until - now)),
+                "available": self.available(index),
+            }
+            for index, stats in sorted(self.clients.items())
+        }
+
+
+scheduler = ClientScheduler()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Backend builds its Database at import time and needs a tracking and a
+# storage URI; nothing connects to them in these tests.
+os.environ.setdefault("DATABASE", "mongodb://localhost/tracking,mongodb://localhost/storage")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
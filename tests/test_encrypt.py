@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from Backend.helper.encrypt import (
+    base62_encode, compress_data, decode_many, decode_token, encode_many, encode_token
+)
+
+
+def test_encode_many_round_trips_through_decode_many():
+    pairs = [(1234567890, 1), (1234567890, 2), (987654321, 2 ** 31)]
+    tokens = encode_many(pairs)
+    assert tokens == [encode_token(chat_id, msg_id) for chat_id, msg_id in pairs]
+    assert decode_many(tokens) == dict(zip(tokens, pairs))
+
+
+def test_decode_many_skips_invalid_tokens():
+    good = encode_token(1, 2)
+    assert decode_many([good, "_AAAA", "not a token!"]) == {good: (1, 2)}
+
+
+def test_legacy_tokens_still_decode():
+    legacy = base62_encode(compress_data(json.dumps({"chat_id": 42, "msg_id": 7})))
+    assert decode_token(legacy) == (42, 7)
+
+
+def test_tampered_token_is_rejected():
+    token = encode_token(1, 2)
+    tampered = token[:-2] + ("A" if token[-2] != "A" else "B") + token[-1]
+    with pytest.raises(ValueError):
+        decode_token(tampered)
@@ -0,0 +1,83 @@
+import asyncio
+
+from pyrogram.session import Session
+
+from Backend.helper import session_pool as session_pool_module
+from Backend.helper.session_pool import DCPool, MediaSessionPool
+
+
+class FakeSession(Session):
+    def __init__(self, dc_id: int = 2):
+        self.dc_id = dc_id
+        self.is_cdn = False
+        self.results = {}
+        self.is_started = asyncio.Event()
+        self.stops = 0
+
+    async def start(self):
+        self.is_started.set()
+
+    async def stop(self):
+        self.stops += 1
+        self.is_started.clear()
+
+
+def make_pool(size: int):
+    pool = MediaSessionPool(size)
+    started = []
+
+    async def start(client, dc_id, auth_key, cdn=False):
+        session = FakeSession(dc_id)
+        await session.start()
+        started.append(session)
+        return session
+
+    pool._start = start
+    dc_pool = pool.pools[(0, 2, False)] = DCPool()
+    dc_pool.auth_key = b"key"
+    return pool, dc_pool, started
+
+
+def test_restarting_session_keeps_its_slot():
+    async def main():
+        pool, dc_pool, started = make_pool(2)
+        assert await pool.acquire(0, None, 2) in started
+        assert len(started) == 2
+
+        # pyrogram's restart(): stop() has run, start() has not yet.
+        restarting = started[0]
+        restarting.is_started.clear()
+        await pool._fill(dc_pool, None, 2)
+        assert restarting in dc_pool.sessions
+        assert len(started) == 2 and restarting.stops == 0
+
+        await restarting.start()
+        await pool._fill(dc_pool, None, 2)
+        assert dc_pool.sessions == started and not dc_pool.down_since
+
+    asyncio.run(main())
+
+
+def test_acquire_waits_for_a_restarting_session():
+    async def main():
+        pool, dc_pool, started = make_pool(1)
+        session = await pool.acquire(0, None, 2)
+        session.is_started.clear()
+        asyncio.get_running_loop().call_later(0.01, session.is_started.set)
+        assert await pool.acquire(0, None, 2) is session
+        assert len(started) == 1
+
+    asyncio.run(main())
+
+
+def test_session_that_never_comes_back_is_stopped_and_replaced(monkeypatch):
+    async def main():
+        monkeypatch.setattr(session_pool_module, "RESTART_GRACE", 0)
+        pool, dc_pool, started = make_pool(1)
+        dead = await pool.acquire(0, None, 2)
+        dead.is_started.clear()
+        await pool._fill(dc_pool, None, 2)
+        assert dead not in dc_pool.sessions and dead.stops == 1
+        assert len(dc_pool.sessions) == 1 and dc_pool.sessions[0] is started[1]
+
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+import asyncio
+
+from Backend.helper.single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_fetch():
+    async def main():
+        flights = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return b"part"
+
+        results = await asyncio.gather(*(flights.do("k", fetch) for _ in range(3)))
+        assert results == [b"part"] * 3
+        assert calls == [1]
+        assert flights.stats == {"fetches": 1, "coalesced": 2}
+        assert not flights.in_flight and not flights.waiters
+
+    asyncio.run(main())
+
+
+def test_fetch_is_cancelled_only_when_last_waiter_leaves():
+    async def main():
+        flights = SingleFlight()
+        cancelled = []
+
+        async def fetch():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        first = asyncio.create_task(flights.do("k", fetch))
+        second = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled and "k" in flights.in_flight
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert cancelled and not flights.in_flight and not flights.waiters
+
+    asyncio.run(main())
+
+
+def test_join_right_after_last_waiter_cancelled():
+    async def main():
+        flights = SingleFlight()
+
+        async def slow():
+            await asyncio.sleep(10)
+
+        async def quick():
+            return b"fresh"
+
+        waiter = asyncio.create_task(flights.do("k", slow))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        # The cancelled fetch's done callback has not run yet; neither call
+        # may be handed the dying task.
+        assert await flights.join("k") is None
+        assert await flights.do("k", quick) == b"fresh"
+
+    asyncio.run(main())
+
+
+def test_do_right_after_last_waiter_cancelled():
+    async def main():
+        flights = SingleFlight()
+
+        async def slow():
+            await asyncio.sleep(10)
+
+        async def quick():
+            return b"fresh"
+
+        waiter = asyncio.create_task(flights.do("k", slow))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        assert await flights.do("k", quick) == b"fresh"
+
+    asyncio.run(main())